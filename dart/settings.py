@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 
 import json
 import os
+import sys
+import tempfile
 
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -48,8 +50,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ranking.metrics.MetricsMiddleware',
+    'ranking.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'ranking.middleware.SessionPlayerMiddleware',
+    'ranking.middleware.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -96,6 +102,29 @@ DATABASES = {
     }
 }
 
+# Optional read replicas of the default database, given as comma separated host[:port]
+# (file names with SQLite). They are available as replica1, replica2, ... and serve the
+# reads of the ranking pages.
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), 1):
+    alias = 'replica{}'.format(number)
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias] = dict(DATABASES['default'], NAME=address.strip())
+    else:
+        host, _, port = address.strip().partition(':')
+        DATABASES[alias] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'])
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+if sys.argv[1:2] == ['test']:
+    # the routing tests read through a mirror of the test database, without setting DATABASE_REPLICAS
+    DATABASES.setdefault('replica1', dict(DATABASES['default'], TEST={'MIRROR': 'default'}))
+
+DATABASE_ROUTERS = ['ranking.routers.ReplicaRouter']
+
+# Seconds a session reads from the primary after it wrote, longer than the replication lag
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -108,6 +137,76 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = 'core.User'
 
+# Seconds to cache the logged in player per session (0 disables the cache)
+SESSION_PLAYER_CACHE_TIMEOUT = 30
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'ranking': {
+            'handlers': ['console'],
+            'level': os.environ.get('RANKING_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# Statements repeated this often within one request are logged as likely N+1 queries
+QUERY_REPEAT_THRESHOLD = 5
+
+# Raise instead of logging when a view exceeds its declared query_budget
+QUERY_BUDGET_STRICT = False
+
+# Directory shared by all gunicorn workers of this host for the /metrics values; empty keeps them per process
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'dart-metrics'))
+# Seconds between writes of a worker's metrics file after requests
+METRICS_FLUSH_INTERVAL = 1
+
+# Upper bound for serving a cached leaderboard; it is invalidated whenever ratings change
+LEADERBOARD_CACHE_TIMEOUT = 300
+
+# The cache is shared by all gunicorn workers so invalidations reach every one of them
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'dart-cache')),
+    }
+}
+
+# Seconds to keep rendered match and profile fragments; ratings changes invalidate them earlier
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Job queue (manage.py run_jobs): attempts before a job is marked failed, the delay before the
+# first retry (doubled for every further one) and the seconds after which a running job is
+# assumed lost with its worker and run again
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_TIMEOUT = 300
+
+# Rating engine the leaderboard shows by default (see ranking.engines), and the length of
+# a Glicko-2 rating period in days
+RATING_ENGINE = 'elo'
+GLICKO_PERIOD_DAYS = 7
+
+# Opponents are only suggested among the players with a match in this many days
+MATCHMAKING_ACTIVE_DAYS = 90
+
+# Live feed on the home page: seconds between looks for matches reported by other processes,
+# and seconds after which a stream is closed (the browser reconnects and resumes)
+LIVE_POLL_INTERVAL = 5
+LIVE_STREAM_SECONDS = 300
+# Match ids are handed out before the reports commit; matches this many ids below the highest
+# one are still sent when they commit late
+LIVE_LOOKBACK = 100
+# Open streams per process. Each one holds a gunicorn thread, keep this well below --threads
+# in the Procfile (the streams need no database connection while they wait)
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 48))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.0/topics/i18n/
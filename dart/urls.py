@@ -18,10 +18,12 @@ from django.urls import path
 from django.conf import settings
 from django.conf.urls import include, url
 
+import ranking.metrics
 import ranking.views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', ranking.metrics.metrics_view, name='metrics'),
 
     path('signup/', ranking.views.SignupView.as_view(), name='signup'),
 
@@ -29,6 +31,15 @@ urlpatterns = [
     path('login/', ranking.views.LoginView.as_view(), name='login'),
     path('logout/', ranking.views.logout, name='logout'),
     path('result/', ranking.views.ReportResultView.as_view(), name='result'),
+    path('players/search.json', ranking.views.player_search, name='player_search'),
+    path('players/opponents.json', ranking.views.matchmaking_json, name='matchmaking'),
     path('matches/', ranking.views.MatchesView.as_view(), name='matches'),
-    path('profile/<slug:slug>/', ranking.views.ProfileView.as_view(), name='profile')
+    path('live/', ranking.views.live_feed, name='live_feed'),
+    path('profile/<slug:slug>/', ranking.views.ProfileView.as_view(), name='profile'),
+    path('profile/<slug:slug>/rating.json', ranking.views.rating_history_json, name='rating_history'),
+    path('standings/', ranking.views.StandingsView.as_view(), name='standings'),
+    path('seasons/<slug:slug>/', ranking.views.SeasonView.as_view(), name='season'),
+    path('head-to-head/', ranking.views.HeadToHeadView.as_view(), name='head_to_head'),
+    path('head-to-head.json', ranking.views.head_to_head_json, name='head_to_head_json'),
+    path('export/<slug:kind>.<slug:fmt>', ranking.views.export, name='export'),
 ]
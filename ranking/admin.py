@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.contrib.admin.actions import delete_selected
 import ranking.models
 # Register your models here.
 
@@ -7,6 +8,105 @@ class PlayerAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
 
 
+def get_match_state(match_id):
+    """The stored date and players of a match, before the admin changes them"""
+    date = ranking.models.Match.objects.prefetch_related(None).filter(pk=match_id).values_list(
+        'date', flat=True).first()
+    players = ranking.models.MatchParticipation.objects.filter(match_id=match_id).values_list('player_id', flat=True)
+    return date, tuple(players)
+
+
+def delete_and_rerate(modeladmin, request, queryset):
+    """Django's bulk delete action, followed by re-rating the deleted matches"""
+    states = {match_id: get_match_state(match_id) for match_id in modeladmin.get_match_ids(queryset)}
+    response = delete_selected(modeladmin, request, queryset)
+    if response is None:
+        # no confirmation page, the objects were deleted
+        for match_id, (date, players) in states.items():
+            ranking.models.Match(pk=match_id, date=date).enqueue_rerating(players)
+    return response
+
+
+delete_and_rerate.short_description = delete_selected.short_description
+
+
+class RerateMixin(object):
+    """Every change is rated again in the background, see Match.enqueue_rerating"""
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if 'delete_selected' in actions:
+            actions['delete_selected'] = (delete_and_rerate, 'delete_selected', delete_and_rerate.short_description)
+        return actions
+
+
+class MatchParticipationInline(admin.TabularInline):
+    model = ranking.models.MatchParticipation
+    fields = ('player', 'score', 'delta')
+    readonly_fields = ('delta',)
+    extra = 2
+    max_num = 2
+
+
+class MatchAdmin(RerateMixin, admin.ModelAdmin):
+    inlines = [MatchParticipationInline]
+    list_display = ('id', 'date', 'winner', 'loser', 'num_legs')
+    readonly_fields = ('winner', 'loser', 'num_legs')
+
+    def get_match_ids(self, queryset):
+        return list(queryset.values_list('id', flat=True))
+
+    def save_model(self, request, obj, form, change):
+        # kept on the form, the admin itself is shared by all requests
+        form.state_before = get_match_state(obj.pk) if change else (None, ())
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        # the participations are saved after the match
+        super().save_related(request, form, formsets, change)
+        since, players = form.state_before
+        form.instance.enqueue_rerating(players, since)
+
+    def delete_model(self, request, obj):
+        date, players = get_match_state(obj.pk)
+        deleted = ranking.models.Match(pk=obj.pk, date=date)
+        super().delete_model(request, obj)
+        deleted.enqueue_rerating(players)
+
+
+class MatchParticipationAdmin(RerateMixin, admin.ModelAdmin):
+    list_display = ('id', 'match', 'player', 'score', 'delta')
+    readonly_fields = ('delta',)
+
+    def get_match_ids(self, queryset):
+        return list(queryset.values_list('match_id', flat=True).distinct())
+
+    def save_model(self, request, obj, form, change):
+        since, players = get_match_state(obj.match_id)
+        super().save_model(request, obj, form, change)
+        obj.match.enqueue_rerating(players, since)
+
+    def delete_model(self, request, obj):
+        since, players = get_match_state(obj.match_id)
+        super().delete_model(request, obj)
+        obj.match.enqueue_rerating(players, since)
+
+
+class SeasonAdmin(admin.ModelAdmin):
+    prepopulated_fields = {"slug": ("name",)}
+    list_display = ('name', 'start', 'end', 'closed')
+    actions = ['close_seasons']
+
+    def close_seasons(self, request, queryset):
+        for season in queryset:
+            season.close()
+        self.message_user(request, '{} Saison(s) abgeschlossen'.format(len(queryset)))
+
+    close_seasons.short_description = 'Tabelle einfrieren'
+
+
 admin.site.register(ranking.models.Player, PlayerAdmin)
-admin.site.register(ranking.models.Match)
-admin.site.register(ranking.models.MatchParticipation)
\ No newline at end of file
+admin.site.register(ranking.models.Match, MatchAdmin)
+admin.site.register(ranking.models.MatchParticipation, MatchParticipationAdmin)
+admin.site.register(ranking.models.Job)
+admin.site.register(ranking.models.Season, SeasonAdmin)
@@ -1,5 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class RankingConfig(AppConfig):
     name = 'ranking'
+
+    def ready(self):
+        from ranking import fragments, leaderboard, live, matchmaking
+        from ranking.models import Match, MatchParticipation, Player
+        from ranking.signals import ratings_changed, statistics_changed
+
+        post_save.connect(leaderboard.invalidate, sender=Player, dispatch_uid='leaderboard_player_saved')
+        post_delete.connect(leaderboard.invalidate, sender=Player, dispatch_uid='leaderboard_player_deleted')
+        ratings_changed.connect(leaderboard.invalidate, dispatch_uid='leaderboard_ratings_changed')
+        ratings_changed.connect(fragments.bump_versions, dispatch_uid='fragments_ratings_changed')
+        # pages listing matches change when an older match is edited or deleted, not only with new ones
+        for model in (Match, MatchParticipation):
+            post_save.connect(fragments.bump_matches_version, sender=model,
+                              dispatch_uid='fragments_{}_saved'.format(model._meta.model_name))
+            post_delete.connect(fragments.bump_matches_version, sender=model,
+                                dispatch_uid='fragments_{}_deleted'.format(model._meta.model_name))
+        statistics_changed.connect(fragments.bump_versions, dispatch_uid='fragments_statistics_changed')
+        ratings_changed.connect(live.HUB.notify, dispatch_uid='live_ratings_changed')
+        # the active players change with the statistics (their last match)
+        ratings_changed.connect(matchmaking.invalidate, dispatch_uid='matchmaking_ratings_changed')
+        statistics_changed.connect(matchmaking.invalidate, dispatch_uid='matchmaking_statistics_changed')
@@ -0,0 +1,5 @@
+"""
+Reproducible performance benchmarks for the hot pages and the Elo replay.
+
+Run them with `manage.py benchmark`; they use a throwaway test database.
+"""
@@ -0,0 +1,133 @@
+import json
+import platform
+import time
+
+import django
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ranking import elo, glicko, jobs
+from ranking.models import Job
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(func, repeat, warmup=1, cold_cache=False):
+    """Run `func` repeatedly and collect latencies and query counts"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    queries = []
+    for _ in range(repeat):
+        if cold_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            func()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(ctx.captured_queries))
+    return {
+        'runs': repeat,
+        'queries': max(queries),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(max(latencies), 3),
+    }
+
+
+class Benchmark(object):
+    """Times the hot views through the test client, logged in as the most active player"""
+
+    def __init__(self, players, repeat=20, cold_cache=False):
+        self.player = players[0]
+        self.opponent = players[1]
+        self.repeat = repeat
+        self.cold_cache = cold_cache
+        self.client = Client()
+        session = self.client.session
+        session['profile'] = self.player.pk
+        session.save()
+
+    def get(self, url):
+        def request():
+            response = self.client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return request
+
+    def report_result(self):
+        response = self.client.post(reverse('result'), {
+            'opponent': self.opponent.pk, 'player_score': 3, 'opponent_score': 1,
+        })
+        assert response.status_code == 302, response.status_code
+
+    def record_match(self):
+        """The job left behind by one report_result run"""
+        for job in Job.objects.filter(name='record_match').claim(1, timeout=300):
+            assert jobs.run(job), job
+
+    def scenarios(self):
+        return [
+            ('home', self.get(reverse('home'))),
+            ('matches', self.get(reverse('matches'))),
+            ('profile', self.get(reverse('profile', args=[self.player.slug]))),
+            ('report_result', self.report_result),
+            ('record_match', self.record_match),
+            ('recompute_elo', elo.recompute),
+            ('recompute_glicko', glicko.recompute),
+        ]
+
+    def run(self, only=None):
+        results = {}
+        for name, func in self.scenarios():
+            if only and name not in only:
+                continue
+            repeat = max(self.repeat // 10, 1) if name.startswith('recompute') else self.repeat
+            results[name] = measure(func, repeat, cold_cache=self.cold_cache)
+        return results
+
+
+def make_report(config, results):
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': config,
+        'environment': {
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(previous, current):
+    """Rows of (scenario, metric, previous, current, relative change) for two reports"""
+    rows = []
+    for name, result in current['results'].items():
+        old = previous.get('results', {}).get(name)
+        if old is None:
+            continue
+        for metric in ('queries', 'p50_ms', 'p90_ms'):
+            before, after = old[metric], result[metric]
+            change = (after - before) / before if before else 0
+            rows.append((name, metric, before, after, change))
+    return rows
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
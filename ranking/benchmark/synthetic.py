@@ -0,0 +1,62 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ranking import elo
+from ranking.models import HeadToHead, Match, MatchParticipation, Player, PlayerStats, bulk_batch_size
+
+SCORES = [(3, 0), (3, 1), (3, 2), (2, 3), (1, 3), (0, 3)]
+
+
+def activity_weights(num_players, skew):
+    """Zipf-like weights: a few regulars play most of the matches, most players rarely play"""
+    return [1 / (rank + 1) ** skew for rank in range(num_players)]
+
+
+def generate_club(num_players=100, num_matches=10000, skew=1.0, days=365, seed=0):
+    """
+    Fill an empty database with a synthetic club and its rated history.
+
+    Players and matches get explicit ids, so the whole history is written with
+    a few bulk inserts on any backend. Returns the players ordered from the
+    most to the least active one.
+    """
+    rnd = random.Random(seed)
+    pw_hash = make_password('benchmark')
+    players = [
+        Player(pk=i + 1, name='Spieler {}'.format(i + 1), slug='spieler-{}'.format(i + 1), pw_hash=pw_hash)
+        for i in range(num_players)
+    ]
+    weights = activity_weights(num_players, skew)
+    start = timezone.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(num_matches, 1)
+
+    with transaction.atomic():
+        Player.objects.bulk_create(players, batch_size=bulk_batch_size(Player))
+        matches = []
+        participations = []
+        for i in range(num_matches):
+            p1 = rnd.choices(players, weights)[0]
+            p2 = p1
+            while p2 is p1:
+                p2 = rnd.choices(players, weights)[0]
+            s1, s2 = rnd.choice(SCORES)
+            winner, loser = (p1, p2) if s1 > s2 else (p2, p1)
+            match = Match(pk=i + 1, date=start + step * i, winner=winner, loser=loser, num_legs=s1 + s2)
+            matches.append(match)
+            participations.append(MatchParticipation(match=match, player=p1, score=s1, delta=0))
+            participations.append(MatchParticipation(match=match, player=p2, score=s2, delta=0))
+        Match.objects.bulk_create(matches, batch_size=bulk_batch_size(Match))
+        MatchParticipation.objects.bulk_create(participations, batch_size=bulk_batch_size(MatchParticipation))
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Player, Match]):
+                cursor.execute(sql)
+
+        elo.recompute()
+        PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+    return players
@@ -2,7 +2,7 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import reverse
 
 from django.utils.http import urlencode
-from ranking.support import get_session_player
+from ranking.support import get_request_player
 
 
 def url_with_query(path, **kwargs):
@@ -13,7 +13,7 @@ def player_login_required(view_func):
 
     def player_login_wrapper(request, *args, **kwargs):
 
-        if get_session_player(request.session) is not None:
+        if get_request_player(request):
             return view_func(request, *args, **kwargs)
         return HttpResponseRedirect(
             url_with_query(reverse('login'), next=request.path)
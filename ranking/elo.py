@@ -0,0 +1,268 @@
+from array import array
+from numbers import Real
+
+from django.db.models import Case, IntegerField, FloatField, Value, When
+
+K_FACTOR = 32
+INITIAL_ELO = 1000
+
+
+def expected_score(elo, opponent_elo):
+    """
+    Expected performance (0..1) of a player against an opponent.
+
+    Either rating can also be a sequence of ratings, then the expected scores
+    are returned as an array: of one player against many opponents, of many
+    players against one opponent, or pairwise for two sequences of equal length.
+    """
+    if isinstance(elo, Real) and isinstance(opponent_elo, Real):
+        return 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+    if isinstance(elo, Real):
+        return array('d', (1 / (1 + 10 ** ((o - elo) / 400)) for o in opponent_elo))
+    if isinstance(opponent_elo, Real):
+        return array('d', (1 / (1 + 10 ** ((opponent_elo - e) / 400)) for e in elo))
+    if len(elo) != len(opponent_elo):
+        raise ValueError('Got {} ratings and {} opponent ratings'.format(len(elo), len(opponent_elo)))
+    return array('d', (1 / (1 + 10 ** ((o - e) / 400)) for e, o in zip(elo, opponent_elo)))
+
+
+def win_probabilities(elos):
+    """
+    The matrix of expected scores of every player (rows) against every other one (columns).
+
+    1 / (1 + 10^((b - a) / 400)) equals q_a / (q_a + q_b) with q = 10^(elo / 400),
+    so only one power per player is needed instead of one per pair.
+    """
+    q = [10 ** (elo / 400) for elo in elos]
+    return [array('d', (q_a / (q_a + q_b) for q_b in q)) for q_a in q]
+
+
+def iter_matches(participations, strict=True, skipped=None):
+    """
+    Group participation rows into matches.
+
+    Expects (id, match id, player id, score, delta, date) tuples ordered by match,
+    yields the two rows of every match with the winner first. Ties are won by
+    the participation that was created first, like Match.get_result does.
+    Matches without exactly two participations raise a ValueError, or are
+    skipped unless `strict`; their rows are then passed to `skipped`, if given.
+    """
+    current = []
+    for row in participations:
+        if current and current[0][1] != row[1]:
+            yield from _complete(current, strict, skipped)
+            current = []
+        current.append(row)
+    if current:
+        yield from _complete(current, strict, skipped)
+
+
+def _complete(rows, strict, skipped):
+    if strict or len(rows) == 2:
+        yield _order_by_result(rows)
+    elif skipped is not None:
+        skipped(rows)
+
+
+def _order_by_result(rows):
+    if len(rows) != 2:
+        raise ValueError('Match {} has {} participations, expected 2'.format(rows[0][1], len(rows)))
+    first, second = sorted(rows)
+    if second[3] > first[3]:
+        return second, first
+    return first, second
+
+
+class EloReplay(object):
+    """
+    Replays Elo ratings over a stream of matches in memory.
+
+    Ratings live in a flat array indexed by player id, so replaying the full
+    history only costs one pass over the participations. The changed deltas
+    and ratings are collected for writing them back in bulk, as well as the
+    rating of both players after every match as (match id, player id, date,
+    elo) tuples.
+    """
+
+    def __init__(self, max_player_id, k_factor=K_FACTOR, initial=INITIAL_ELO):
+        self.k_factor = k_factor
+        self.ratings = array('d', [initial]) * (max_player_id + 1)
+        self.changed_deltas = {}
+        self.history = []
+        self.num_matches = 0
+        # ids of the incomplete matches, see drop
+        self.dropped = []
+
+    def play(self, winner, loser):
+        ratings = self.ratings
+        w_elo = ratings[winner[2]]
+        l_elo = ratings[loser[2]]
+        exp_w = expected_score(w_elo, l_elo)
+        exp_l = 1 - exp_w
+        ratings[winner[2]] = w_elo + self.k_factor * (1 - exp_w)
+        ratings[loser[2]] = l_elo + self.k_factor * (0 - exp_l)
+        self.num_matches += 1
+
+        for pt, old_elo in ((winner, w_elo), (loser, l_elo)):
+            # truncated like Match.rate does
+            delta = int(ratings[pt[2]] - old_elo)
+            if delta != pt[4]:
+                self.changed_deltas[pt[0]] = delta
+            self.history.append((pt[1], pt[2], pt[5], ratings[pt[2]]))
+
+    def drop(self, rows):
+        """Leave an incomplete match unrated: its deltas are reset and it gets no rating snapshots"""
+        for pt in rows:
+            if pt[4] != 0:
+                self.changed_deltas[pt[0]] = 0
+        self.dropped.append(rows[0][1])
+
+    def replay(self, participations):
+        """Rate all matches like rerate does: matches left incomplete in the admin are dropped"""
+        for winner, loser in iter_matches(participations, strict=False, skipped=self.drop):
+            self.play(winner, loser)
+        return self
+
+
+def bulk_update_field(queryset, field, values, output_field, batch_size=300):
+    """
+    Write a {pk: value} mapping into one column with one UPDATE per batch.
+
+    Every row takes three query parameters, keep the batches below SQLite's
+    limit of 999.
+
+    Returns the number of updated rows.
+    """
+    pks = list(values)
+    updated = 0
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        updated += queryset.filter(pk__in=batch).update(**{field: Case(
+            *[When(pk=pk, then=Value(values[pk])) for pk in batch],
+            output_field=output_field,
+        )})
+    return updated
+
+
+def recompute(k_factor=K_FACTOR, initial=INITIAL_ELO, dry_run=False, chunk_size=2000):
+    """
+    Replay the whole match history and store the resulting ratings and deltas.
+
+    The rating history is rewritten as a whole. All players are locked for the
+    replay, so reports wait until it is stored instead of being overwritten.
+    Matches left incomplete in the admin are not rated, like in rerate.
+
+    Returns a (number of matches, changed participations, changed players,
+    rating snapshots) tuple.
+    """
+    from django.db import transaction
+    from django.db.models import Max
+
+    from ranking import engines, metrics
+    from ranking.models import MatchParticipation, Player, RatingSnapshot, bulk_batch_size
+    from ranking.signals import ratings_changed
+
+    with transaction.atomic():
+        if not dry_run:
+            # a report during the replay would be overwritten, hold them off like rerate does
+            list(Player.objects.select_for_update().order_by('pk').values_list('id', flat=True))
+        max_player_id = Player.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        engine = EloReplay(max_player_id, k_factor=k_factor, initial=initial)
+        participations = MatchParticipation.objects.order_by('match__date', 'match_id', 'id').values_list(
+            'id', 'match_id', 'player_id', 'score', 'delta', 'match__date')
+        engine.replay(participations.iterator(chunk_size=chunk_size))
+
+        changed_elos = {
+            pk: engine.ratings[pk]
+            for pk, elo in Player.objects.values_list('id', 'elo').iterator(chunk_size=chunk_size)
+            if engine.ratings[pk] != elo
+        }
+
+        if not dry_run:
+            bulk_update_field(MatchParticipation.objects, 'delta', engine.changed_deltas, IntegerField())
+            bulk_update_field(Player.objects, 'elo', changed_elos, FloatField())
+            RatingSnapshot.objects.all().delete()
+            RatingSnapshot.objects.bulk_create(
+                (RatingSnapshot(match_id=match_id, player_id=player_id, date=date, elo=rating)
+                 for match_id, player_id, date, rating in engine.history),
+                batch_size=bulk_batch_size(RatingSnapshot),
+            )
+            # the history is replayed after it was changed, the batch engines have to follow
+            engines.enqueue_batches()
+            transaction.on_commit(lambda: ratings_changed.send(sender=Player))
+    if not dry_run:
+        metrics.ELO_RECOMPUTATIONS.inc()
+
+    return engine.num_matches, len(engine.changed_deltas), len(changed_elos), len(engine.history)
+
+
+def rerate(players, date, match_id, k_factor=K_FACTOR, initial=INITIAL_ELO, chunk_size=2000):
+    """
+    Correct the ratings after the matches of `players` from (date, match id) on were changed.
+
+    Every player's rating right before that point is read from the latest rating
+    snapshot before it. Only the later matches whose ratings change are replayed:
+    those of the given players, and those of every opponent from their first
+    match against an affected player on. For all other matches the stored
+    snapshots are taken as they are.
+    The changed deltas, ratings and snapshots are written in bulk.
+
+    Returns a (replayed matches, changed participations, changed players,
+    rewritten snapshots) tuple.
+    """
+    from django.db import transaction
+    from django.db.models import OuterRef, Q, Subquery
+
+    from ranking import fragments
+    from ranking.models import MatchParticipation, Player, RatingSnapshot, bulk_batch_size
+    from ranking.signals import ratings_changed
+
+    with transaction.atomic():
+        # reports of any player could join the replayed matches, hold them off until the end
+        elos = dict(Player.objects.select_for_update().order_by('pk').values_list('id', 'elo'))
+        before = Q(date__lt=date) | Q(date=date, match_id__lt=match_id)
+        latest = RatingSnapshot.objects.filter(before, player=OuterRef('pk')).order_by('-date', '-match_id')
+        engine = EloReplay(max(elos, default=0), k_factor=k_factor, initial=initial)
+        for pk, elo in Player.objects.annotate(elo_before=Subquery(latest.values('elo')[:1])).values_list(
+                'id', 'elo_before'):
+            if elo is not None:
+                engine.ratings[pk] = elo
+
+        after = Q(match__date__gt=date) | Q(match__date=date, match_id__gte=match_id)
+        stored = {
+            (match, player): elo for match, player, elo in RatingSnapshot.objects.filter(after).values_list(
+                'match_id', 'player_id', 'elo').iterator(chunk_size=chunk_size)
+        }
+        participations = MatchParticipation.objects.filter(after).order_by('match__date', 'match_id', 'id').values_list(
+            'id', 'match_id', 'player_id', 'score', 'delta', 'match__date')
+        affected = set(players)
+        replayed = []
+        # matches left incomplete in the admin are not rated
+        for winner, loser in iter_matches(participations.iterator(chunk_size=chunk_size), strict=False,
+                                          skipped=engine.drop):
+            if winner[2] in affected or loser[2] in affected:
+                affected.update((winner[2], loser[2]))
+                engine.play(winner, loser)
+                replayed.append(winner[1])
+            else:
+                for pt in (winner, loser):
+                    engine.ratings[pt[2]] = stored.get((pt[1], pt[2]), engine.ratings[pt[2]])
+
+        changed_elos = {pk: engine.ratings[pk] for pk in affected if pk in elos and engine.ratings[pk] != elos[pk]}
+        bulk_update_field(MatchParticipation.objects, 'delta', engine.changed_deltas, IntegerField())
+        bulk_update_field(Player.objects, 'elo', changed_elos, FloatField())
+        batch_size = bulk_batch_size(RatingSnapshot)
+        # the snapshots of matches that became incomplete are dropped, not rewritten
+        rewritten = replayed + engine.dropped
+        for i in range(0, len(rewritten), batch_size):
+            RatingSnapshot.objects.filter(match_id__in=rewritten[i:i + batch_size]).delete()
+        RatingSnapshot.objects.bulk_create(
+            (RatingSnapshot(match_id=match_id, player_id=player_id, date=date, elo=rating)
+             for match_id, player_id, date, rating in engine.history),
+            batch_size=batch_size,
+        )
+        player_ids = sorted(affected)
+        transaction.on_commit(lambda: fragments.forget_matches(rewritten))
+        transaction.on_commit(lambda: ratings_changed.send(sender=Player, players=player_ids))
+
+    return engine.num_matches, len(engine.changed_deltas), len(changed_elos), len(engine.history)
@@ -0,0 +1,72 @@
+"""
+The rating systems players can be ranked by.
+
+Elo is updated with every reported match (see Match.update_elos). Engines
+that rate in batches are recomputed by the `recompute_ratings` job after
+matches were recorded.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+
+from ranking import elo, glicko
+
+
+class RatingEngine(object):
+    """
+    A rating system.
+
+    `field` is the Player field holding the rating, `deviation_field` the one
+    holding its uncertainty, if the system has one.
+    """
+    name = None
+    label = None
+    field = None
+    deviation_field = None
+    batch = False
+
+    def recompute(self, dry_run=False):
+        """Rate the full match history and store the players' ratings"""
+        raise NotImplementedError
+
+
+class EloEngine(RatingEngine):
+    name = 'elo'
+    label = 'Elo'
+    field = 'elo'
+
+    def recompute(self, dry_run=False):
+        return elo.recompute(dry_run=dry_run)
+
+
+class Glicko2Engine(RatingEngine):
+    name = 'glicko2'
+    label = 'Glicko-2'
+    field = 'glicko'
+    deviation_field = 'glicko_deviation'
+    batch = True
+
+    def recompute(self, dry_run=False):
+        return glicko.recompute(period_days=getattr(settings, 'GLICKO_PERIOD_DAYS', glicko.PERIOD_DAYS),
+                                dry_run=dry_run)
+
+
+ENGINES = OrderedDict((engine.name, engine) for engine in (EloEngine(), Glicko2Engine()))
+
+
+def get_engine(name=None):
+    """The engine registered under `name`, the default one (settings.RATING_ENGINE) if None"""
+    name = name or getattr(settings, 'RATING_ENGINE', EloEngine.name)
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError('Unknown rating engine {}'.format(name))
+
+
+def enqueue_batches():
+    """Have the batch engines rate the matches again; call it inside the transaction that changed them"""
+    from ranking.models import Job
+
+    for engine in ENGINES.values():
+        if engine.batch:
+            Job.objects.enqueue_once('recompute_ratings', engine=engine.name)
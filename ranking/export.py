@@ -0,0 +1,80 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ranking.elo import iter_matches
+from ranking.models import MatchParticipation, Player
+
+CHUNK_SIZE = 2000
+
+PLAYER_FIELDS = ['id', 'name', 'slug', 'elo']
+PARTICIPATION_FIELDS = ['id', 'match', 'date', 'player', 'score', 'delta']
+MATCH_FIELDS = ['id', 'date', 'winner', 'winner_score', 'winner_delta', 'loser', 'loser_score', 'loser_delta']
+
+
+def _participations(start=None, end=None, player=None):
+    participations = MatchParticipation.objects.order_by('match__date', 'match_id', 'id')
+    if start is not None:
+        participations = participations.filter(match__date__gte=start)
+    if end is not None:
+        participations = participations.filter(match__date__lte=end)
+    if player is not None:
+        participations = participations.filter(
+            match__in=MatchParticipation.objects.filter(player=player).values('match'))
+    return participations
+
+
+def export_players(start=None, end=None, player=None):
+    players = Player.objects.order_by('id')
+    if player is not None:
+        players = players.filter(pk=player.pk)
+    return players.values_list(*PLAYER_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_participations(start=None, end=None, player=None):
+    participations = _participations(start, end)
+    if player is not None:
+        participations = participations.filter(player=player)
+    return participations.values_list(
+        'id', 'match_id', 'match__date', 'player__slug', 'score', 'delta').iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_matches(start=None, end=None, player=None):
+    rows = _participations(start, end, player).values_list(
+        'id', 'match_id', 'player__slug', 'score', 'delta', 'match__date').iterator(chunk_size=CHUNK_SIZE)
+    # the response is already on its way, an incomplete match must not cut it short
+    for winner, loser in iter_matches(rows, strict=False):
+        yield (winner[1], winner[5], winner[2], winner[3], winner[4], loser[2], loser[3], loser[4])
+
+
+EXPORTS = {
+    'players': (PLAYER_FIELDS, export_players),
+    'participations': (PARTICIPATION_FIELDS, export_participations),
+    'matches': (MATCH_FIELDS, export_matches),
+}
+
+
+class _Echo(object):
+    """File-like object that hands the written line back to the csv writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def as_csv(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def as_ndjson(fields, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+FORMATS = {
+    'csv': (as_csv, 'text/csv'),
+    'ndjson': (as_ndjson, 'application/x-ndjson'),
+}
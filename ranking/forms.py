@@ -5,7 +5,7 @@ from django.forms import (
     CharField, Form, ValidationError, ModelForm, ModelChoiceField, IntegerField
 )
 from django.utils.translation import ugettext as _
-from django_select2.forms import Select2Widget
+from django_select2.forms import ModelSelect2Widget
 from django.core.validators import MinValueValidator
 
 from ranking.models import Player, Match
@@ -73,8 +73,27 @@ class LoginForm(Form):
             raise ValidationError(error_message)
 
 
+class PlayerSearchWidget(ModelSelect2Widget):
+    """Renders only the selected player; the options are fetched from the player_search view while typing"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('model', Player)
+        kwargs.setdefault('data_view', 'player_search')
+        kwargs.setdefault('attrs', {'data-minimum-input-length': 1})
+        super().__init__(*args, **kwargs)
+
+    def set_to_cache(self):
+        # only django_select2's own view looks the widget up in the cache
+        pass
+
+
 class ReportResultForm(Form):
-    opponent = ModelChoiceField(queryset=Player.objects.all(), widget=Select2Widget)
+    opponent = ModelChoiceField(queryset=Player.objects.all(), widget=PlayerSearchWidget)
     player_score = IntegerField(validators=[MinValueValidator(0)], widget=NumberInput(attrs={'style': 'width:4ch'}))
     opponent_score = IntegerField(validators=[MinValueValidator(0)], widget=NumberInput(attrs={'style': 'width:4ch'}))
 
+    def __init__(self, *args, player=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if player:
+            self.fields['opponent'].queryset = self.fields['opponent'].queryset.exclude(pk=player.pk)
+
@@ -0,0 +1,96 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.loader import render_to_string
+
+from ranking.metrics import record_cache
+from ranking.models import MatchParticipation
+
+# Bump whenever fragments/match.html changes so no stale markup is served after a deploy
+MATCH_FRAGMENT_VERSION = 1
+
+MATCH_KEY = 'fragment:match:{}:{}:{}'
+PLAYER_VERSION_KEY = 'fragment:player:{}'
+RATINGS_VERSION_KEY = 'fragment:ratings'
+MATCHES_VERSION_KEY = 'fragment:matches'
+
+
+def get_timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def render_matches(matches):
+    """
+    The rendered fragments/match.html of all matches, concatenated.
+
+    A match only changes when ratings are recomputed, so its markup is cached by
+    id and the ratings version (see also forget_matches). The participations
+    are only loaded for the matches that are not cached yet.
+    """
+    matches = list(matches)
+    if not matches:
+        return ''
+    ratings_version, = _get_versions([RATINGS_VERSION_KEY])
+    keys = {match.pk: MATCH_KEY.format(MATCH_FRAGMENT_VERSION, ratings_version, match.pk) for match in matches}
+    rendered = cache.get_many(list(keys.values()))
+    missing = [match for match in matches if keys[match.pk] not in rendered]
+    record_cache('match_fragment', not missing)
+    if missing:
+        # read from the primary, a lagging replica would keep outdated deltas cached
+        participations = MatchParticipation.objects.using(DEFAULT_DB_ALIAS).select_related('player').order_by('id')
+        prefetch_related_objects(missing, Prefetch('participations', queryset=participations))
+        fresh = {keys[match.pk]: render_to_string('fragments/match.html', {'match': match}) for match in missing}
+        cache.set_many(fresh, get_timeout())
+        rendered.update(fresh)
+    return ''.join(rendered[keys[match.pk]] for match in matches)
+
+
+def forget_matches(match_ids):
+    """Drop the cached markup of matches whose deltas were changed"""
+    ratings_version, = _get_versions([RATINGS_VERSION_KEY])
+    cache.delete_many([MATCH_KEY.format(MATCH_FRAGMENT_VERSION, ratings_version, pk) for pk in match_ids])
+    cache.set(MATCHES_VERSION_KEY, uuid4().hex, None)
+
+
+def _get_versions(keys):
+    """
+    The current version tokens stored under the keys.
+
+    Missing versions are created fresh instead of starting at a fixed value, so an
+    evicted version can never bring back fragments rendered before the eviction.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_player_version(player_id):
+    """Changes whenever the player's rating or statistics change"""
+    return '.'.join(_get_versions([RATINGS_VERSION_KEY, PLAYER_VERSION_KEY.format(player_id)]))
+
+
+def get_matches_version():
+    """
+    Changes whenever any match changes, including older ones: when it is edited or
+    deleted, when its deltas are rated again and when all ratings are recomputed.
+    """
+    return '.'.join(_get_versions([RATINGS_VERSION_KEY, MATCHES_VERSION_KEY]))
+
+
+def bump_matches_version(**kwargs):
+    """Receiver for saved and deleted matches and participations"""
+    transaction.on_commit(lambda: cache.set(MATCHES_VERSION_KEY, uuid4().hex, None))
+
+
+def bump_versions(players=None, **kwargs):
+    """Receiver for `ratings_changed`; without `players` every player's fragments are outdated"""
+    if players is None:
+        cache.set(RATINGS_VERSION_KEY, uuid4().hex, None)
+    else:
+        cache.set_many({PLAYER_VERSION_KEY.format(pk): uuid4().hex for pk in players}, None)
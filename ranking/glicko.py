@@ -0,0 +1,202 @@
+"""
+Glicko-2 ratings (http://www.glicko.net/glicko/glicko2.pdf), rated per period.
+
+All matches of a period are rated at once against the ratings the players had
+when the period started, so a whole period is one pass over its matches plus
+one update per player who played in it.
+"""
+from array import array
+from datetime import datetime
+from math import exp, log, pi, sqrt
+
+from django.db.models import FloatField
+from django.utils import timezone
+
+INITIAL_RATING = 1500
+INITIAL_DEVIATION = 350
+INITIAL_VOLATILITY = 0.06
+# constrains the change in volatility, Glickman suggests 0.3 to 1.2
+TAU = 0.5
+PERIOD_DAYS = 7
+# Glicko-2 works on this scale internally
+SCALE = 173.7178
+# a Monday, periods of whole weeks start on Mondays (UTC)
+EPOCH = datetime(2018, 1, 1, tzinfo=timezone.utc)
+EPSILON = 0.000001
+
+
+def get_period(date, period_days=PERIOD_DAYS):
+    """Number of the rating period a date falls into"""
+    return (date - EPOCH).days // period_days
+
+
+def _g(phi):
+    return 1 / sqrt(1 + 3 * phi * phi / (pi * pi))
+
+
+def information(rating, opponent_rating, opponent_deviation):
+    """
+    How much a match against the opponent tells about a player's rating (Glicko scale).
+
+    It is g^2 * E * (1 - E) from step 3, the share of a match in 1 / v: the
+    closer the match and the more certain the opponent's rating, the more.
+    """
+    g = _g(opponent_deviation / SCALE)
+    e = 1 / (1 + exp(-g * (rating - opponent_rating) / SCALE))
+    return g * g * e * (1 - e)
+
+
+class Glicko2Periods(object):
+    """
+    Rates matches period by period in memory.
+
+    Like EloReplay, ratings (on the Glicko-2 scale) live in flat arrays indexed
+    by player id. A player's deviation only grows in periods without matches, so
+    it is brought up to date when the player plays again instead of touching
+    every player in every period.
+    """
+
+    def __init__(self, max_player_id, tau=TAU):
+        size = max_player_id + 1
+        self.tau = tau
+        # INITIAL_RATING is 0 on the Glicko-2 scale
+        self.mu = array('d', [0.0]) * size
+        self.phi = array('d', [INITIAL_DEVIATION / SCALE]) * size
+        self.sigma = array('d', [INITIAL_VOLATILITY]) * size
+        # the period each player was last rated in
+        self.rated = array('l', [-1]) * size
+        self.num_matches = 0
+        self.num_periods = 0
+
+    def _inflate(self, player, period):
+        """The deviation of a player before `period`, grown for every period without matches"""
+        if self.rated[player] < 0:
+            return self.phi[player]
+        idle = period - self.rated[player] - 1
+        phi = self.phi[player]
+        sigma = self.sigma[player]
+        return min(sqrt(phi * phi + idle * sigma * sigma), INITIAL_DEVIATION / SCALE)
+
+    def rate_period(self, period, results):
+        """Rate the (winner id, loser id) results of one period"""
+        mu = self.mu
+        players = {player for result in results for player in result}
+        phi = {player: self._inflate(player, period) for player in players}
+        g = {player: _g(phi[player]) for player in players}
+        # sums over all opponents of g^2 * E * (1 - E) and of g * (s - E)
+        variance = dict.fromkeys(players, 0.0)
+        improvement = dict.fromkeys(players, 0.0)
+        for winner, loser in results:
+            g_l = g[loser]
+            g_w = g[winner]
+            e_w = 1 / (1 + exp(-g_l * (mu[winner] - mu[loser])))
+            e_l = 1 / (1 + exp(-g_w * (mu[loser] - mu[winner])))
+            variance[winner] += g_l * g_l * e_w * (1 - e_w)
+            improvement[winner] += g_l * (1 - e_w)
+            variance[loser] += g_w * g_w * e_l * (1 - e_l)
+            improvement[loser] -= g_w * e_l
+
+        for player in players:
+            v = 1 / variance[player]
+            sigma = self._volatility(phi[player], self.sigma[player], v, v * improvement[player])
+            phi_star = sqrt(phi[player] * phi[player] + sigma * sigma)
+            new_phi = 1 / sqrt(1 / (phi_star * phi_star) + 1 / v)
+            mu[player] += new_phi * new_phi * improvement[player]
+            self.phi[player] = new_phi
+            self.sigma[player] = sigma
+            self.rated[player] = period
+        self.num_matches += len(results)
+        self.num_periods += 1
+
+    def _volatility(self, phi, sigma, v, delta):
+        """The new volatility, by the Illinois algorithm of step 5"""
+        tau = self.tau
+        a = log(sigma * sigma)
+        phi2 = phi * phi
+        delta2 = delta * delta
+
+        def f(x):
+            ex = exp(x)
+            return ex * (delta2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2) - (x - a) / (tau * tau)
+
+        x_a = a
+        if delta2 > phi2 + v:
+            x_b = log(delta2 - phi2 - v)
+        else:
+            k = 1
+            while f(a - k * tau) < 0:
+                k += 1
+            x_b = a - k * tau
+        f_a, f_b = f(x_a), f(x_b)
+        while abs(x_b - x_a) > EPSILON:
+            x_c = x_a + (x_a - x_b) * f_a / (f_b - f_a)
+            f_c = f(x_c)
+            if f_c * f_b <= 0:
+                x_a, f_a = x_b, f_b
+            else:
+                f_a /= 2
+            x_b, f_b = x_c, f_c
+        return exp(x_a / 2)
+
+    def replay(self, matches, period_days=PERIOD_DAYS):
+        """Rate (date, winner id, loser id) rows ordered by date"""
+        current, results = None, []
+        for date, winner, loser in matches:
+            period = get_period(date, period_days)
+            if period != current and results:
+                self.rate_period(current, results)
+                results = []
+            current = period
+            results.append((winner, loser))
+        if results:
+            self.rate_period(current, results)
+        return self
+
+    def get_rating(self, player, period):
+        """(rating, deviation, volatility) of a player at the end of `period`, on the Glicko scale"""
+        return (
+            self.mu[player] * SCALE + INITIAL_RATING,
+            self._inflate(player, period + 1) * SCALE,
+            self.sigma[player],
+        )
+
+
+def recompute(period_days=PERIOD_DAYS, tau=TAU, dry_run=False, chunk_size=2000):
+    """
+    Rate the whole match history period by period and store the players' ratings.
+
+    The current period is rated with the matches played so far, so the
+    leaderboard follows new matches before the period is over.
+
+    Returns a (number of matches, number of periods, changed players) tuple.
+    """
+    from django.db import transaction
+    from django.db.models import Max
+
+    from ranking.elo import bulk_update_field
+    from ranking.models import Match, Player
+    from ranking.signals import ratings_changed
+
+    max_player_id = Player.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    engine = Glicko2Periods(max_player_id, tau=tau)
+    matches = Match.objects.prefetch_related(None).filter(winner__isnull=False, loser__isnull=False).order_by(
+        'date', 'id').values_list('date', 'winner_id', 'loser_id')
+    engine.replay(matches.iterator(chunk_size=chunk_size), period_days)
+
+    period = get_period(timezone.now(), period_days)
+    changed = {}
+    for pk, rating, deviation, volatility in Player.objects.values_list(
+            'id', 'glicko', 'glicko_deviation', 'glicko_volatility').iterator(chunk_size=chunk_size):
+        new = engine.get_rating(pk, period)
+        if new != (rating, deviation, volatility):
+            changed[pk] = new
+
+    if not dry_run:
+        with transaction.atomic():
+            for i, field in enumerate(('glicko', 'glicko_deviation', 'glicko_volatility')):
+                bulk_update_field(Player.objects, field, {pk: new[i] for pk, new in changed.items()}, FloatField())
+            player_ids = sorted(changed)
+            if player_ids:
+                transaction.on_commit(lambda: ratings_changed.send(sender=Player, players=player_ids))
+
+    return engine.num_matches, engine.num_periods, len(changed)
@@ -0,0 +1,40 @@
+from ranking.models import RatingSnapshot
+
+
+def get_rating_series(player, start=None, end=None, max_points=200):
+    """
+    A player's Elo over time as a list of (date, elo) tuples.
+
+    The series starts with the rating the player had at `start`. Longer series
+    are downsampled to at most `max_points` by splitting the time range into
+    equal buckets and keeping the last rating of each, so the rating at the end
+    of every bucket is exact.
+    """
+    snapshots = RatingSnapshot.objects.filter(player=player)
+    points = []
+    if start is not None:
+        previous = snapshots.filter(date__lt=start).order_by('-date', '-match_id').values_list('elo', flat=True).first()
+        if previous is not None:
+            points.append((start, previous))
+        snapshots = snapshots.filter(date__gte=start)
+    if end is not None:
+        snapshots = snapshots.filter(date__lte=end)
+    points.extend(snapshots.order_by('date', 'match_id').values_list('date', 'elo'))
+    return downsample(points, max_points)
+
+
+def downsample(points, max_points):
+    if max_points < 2:
+        # refused rather than returning the full series, which is what callers limit
+        raise ValueError('Cannot downsample to fewer than 2 points')
+    if len(points) <= max_points:
+        return points
+    first, last = points[0][0], points[-1][0]
+    width = (last - first) / max_points
+    if not width:
+        return points[-max_points:]
+    buckets = {}
+    for date, elo in points:
+        # dict keeps the insertion order, later points overwrite earlier ones
+        buckets[min(int((date - first) / width), max_points - 1)] = (date, elo)
+    return list(buckets.values())
@@ -0,0 +1,96 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declare how many queries a function based view may run; see QueryInstrumentationMiddleware"""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        # class based views declare the budget as class attribute
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+class QueryRecorder(object):
+    """Database execute wrapper that counts and times every query"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            # the parameters are passed separately, so the same statement shape has the same text
+            self.statements[sql] += 1
+
+    def repeated(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+    def record(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class QueryInstrumentationMiddleware(object):
+    """
+    Logs the number of queries, the DB time and the total time of every request.
+
+    Statements that run at least QUERY_REPEAT_THRESHOLD times in one request
+    are logged as likely N+1 patterns. Views can declare a query budget (see
+    `query_budget`); exceeding it is logged, or raises QueryBudgetExceeded if
+    QUERY_BUDGET_STRICT is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        logger.info(
+            'REQUEST: view=%s method=%s status=%s queries=%d db_ms=%.1f total_ms=%.1f',
+            view_name, request.method, response.status_code, recorder.count, recorder.duration * 1000, total * 1000,
+            extra={'view': view_name, 'queries': recorder.count, 'db_time': recorder.duration, 'total_time': total},
+        )
+        for sql, count in recorder.repeated(getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)):
+            logger.warning('REQUEST: repeated query view=%s count=%d sql=%s', view_name, count, sql)
+
+        budget = get_query_budget(match.func) if match else None
+        if budget is not None and recorder.count > budget:
+            message = 'view={} ran {} queries, budget is {}'.format(view_name, recorder.count, budget)
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning('REQUEST: query budget exceeded %s', message)
+        return response
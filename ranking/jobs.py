@@ -0,0 +1,112 @@
+"""
+A small job queue stored in the database and worked off by `manage.py run_jobs`.
+
+Jobs are enqueued in the transaction of the change they belong to (see
+JobQuerySet.enqueue). A job function runs in one transaction together with the
+deletion of its row, so it either takes effect completely and exactly once, or
+not at all and is retried later with exponential backoff.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ranking import elo, engines, metrics
+from ranking.models import HeadToHead, Job, Match, PlayerStats
+from ranking.signals import statistics_changed
+
+logger = logging.getLogger(__name__)
+
+JOBS = {}
+
+
+class JobLost(Exception):
+    """The job was claimed again by another worker while it ran"""
+
+
+class RetryLater(Exception):
+    """Raised by a job that cannot run yet; it is retried without using up an attempt"""
+
+
+def job(func):
+    """Register a function that can be enqueued under its name"""
+    JOBS[func.__name__] = func
+    return func
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=getattr(settings, 'JOB_RETRY_DELAY', 10) * 2 ** (attempts - 1))
+
+
+def run(job):
+    """Run a claimed job; returns whether it succeeded"""
+    try:
+        with transaction.atomic():
+            JOBS[job.name](**job.get_arguments())
+            deleted, _ = Job.objects.filter(pk=job.pk, started=job.started).delete()
+            if not deleted:
+                raise JobLost()
+    except JobLost:
+        logger.warning('JOBS: %s was taken over by another worker, its changes are rolled back', job)
+        metrics.JOBS_PROCESSED.inc(job=job.name, result='lost')
+        return False
+    except RetryLater as e:
+        logger.info('JOBS: %s postponed: %s', job, e)
+        Job.objects.filter(pk=job.pk, started=job.started).update(
+            status=Job.PENDING, run_after=timezone.now() + get_retry_delay(1), attempts=F('attempts') - 1)
+        metrics.JOBS_PROCESSED.inc(job=job.name, result='postponed')
+        return False
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < getattr(settings, 'JOB_MAX_ATTEMPTS', 5):
+            logger.warning('JOBS: %s failed in attempt %d, retrying', job, job.attempts, exc_info=True)
+            status, run_after, result = Job.PENDING, timezone.now() + get_retry_delay(job.attempts), 'retry'
+        else:
+            logger.error('JOBS: %s failed in attempt %d, giving up', job, job.attempts, exc_info=True)
+            status, run_after, result = Job.FAILED, job.run_after, 'failed'
+        Job.objects.filter(pk=job.pk, started=job.started).update(
+            status=status, run_after=run_after, last_error=error)
+        metrics.JOBS_PROCESSED.inc(job=job.name, result=result)
+        return False
+    metrics.JOBS_PROCESSED.inc(job=job.name, result='done')
+    return True
+
+
+@job
+def record_match(match, ratings):
+    """The statistics and rating snapshots of a reported match; `ratings` are the players' Elo right after it"""
+    match = Match.objects.prefetch_related(None).filter(pk=match).first()
+    if match is None:
+        # deleted before the job ran, there is nothing left to record
+        return
+    pt1, pt2 = match.participations.order_by('id')
+    match.update_statistics(pt1, pt2)
+    match.store_ratings({int(player_id): elo for player_id, elo in ratings.items()})
+    engines.enqueue_batches()
+    player_ids = [pt1.player_id, pt2.player_id]
+    transaction.on_commit(lambda: statistics_changed.send(sender=Match, players=player_ids))
+
+
+@job
+def rerate(players, date, match):
+    """Correct ratings and statistics after a match was changed in the admin, see Match.enqueue_rerating"""
+    if Job.objects.unfinished('record_match').exists():
+        # the rating snapshots the replay starts from are not all stored yet
+        raise RetryLater('matches are still being recorded')
+    elo.rerate(players, parse_datetime(date), match)
+    # the statistics only change between the players of the match, before and after the change
+    HeadToHead.objects.rebuild(players)
+    PlayerStats.objects.rebuild(HeadToHead.objects.filter(player__in=players), players)
+    engines.enqueue_batches()
+    transaction.on_commit(lambda: statistics_changed.send(sender=Match, players=players))
+
+
+@job
+def recompute_ratings(engine):
+    """Rate the full match history with a batch engine, see ranking.engines"""
+    engines.get_engine(engine).recompute()
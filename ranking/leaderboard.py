@@ -0,0 +1,52 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, FloatField, Value
+
+from ranking import engines
+from ranking.metrics import record_cache
+from ranking.models import Player
+
+CACHE_KEY = 'leaderboard:{}'
+VERSION_KEY = 'leaderboard:version'
+
+
+def get_leaderboard(engine=None):
+    """
+    All players ordered by the rating of an engine (the default one if None).
+
+    Each player is annotated with its `rank` (ties share a rank), its `rating`
+    and its rating's `deviation` (None if the engine has none).
+    """
+    engine = engine or engines.get_engine()
+    key = CACHE_KEY.format(engine.name)
+    ranking = cache.get(key)
+    record_cache('leaderboard', ranking is not None)
+    if ranking is None:
+        # read from the primary, a lagging replica would keep an outdated leaderboard cached
+        players = Player.objects.using(DEFAULT_DB_ALIAS).ranked(engine.field).only('id', 'name', 'slug')
+        ranking = list(players.annotate(
+            rating=F(engine.field),
+            deviation=F(engine.deviation_field) if engine.deviation_field else Value(None, FloatField()),
+        ))
+        cache.set(key, ranking, getattr(settings, 'LEADERBOARD_CACHE_TIMEOUT', 300))
+    return ranking
+
+
+def get_rank(player, engine=None):
+    for p in get_leaderboard(engine):
+        if p.pk == player.pk:
+            return p.rank
+    return None
+
+
+def get_version():
+    """Token that changes whenever the leaderboard is invalidated"""
+    return cache.get_or_set(VERSION_KEY, lambda: uuid4().hex, None)
+
+
+def invalidate(**kwargs):
+    keys = [CACHE_KEY.format(name) for name in engines.ENGINES] + [VERSION_KEY]
+    transaction.on_commit(lambda: cache.delete_many(keys))
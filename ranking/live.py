@@ -0,0 +1,235 @@
+"""
+Live feed of reported matches and leaderboard changes for the home page, sent
+as Server-Sent Events.
+
+Every process runs one Hub. Its thread looks for new matches right after the
+ratings changed in this process and otherwise every LIVE_POLL_INTERVAL
+seconds, for the changes made by other processes and the job worker. The
+events are built once and shared by all connections, so connected screens
+cost no queries.
+
+Match ids are handed out before the reports commit, so a match can show up
+after one with a higher id. The hub keeps looking LIVE_LOOKBACK ids back for
+matches it has not sent yet. When the leaderboard changes without a new match
+(a correction, a recomputation, a batch engine) a `ranking` event is sent.
+
+Events are numbered per process. Their ids also carry the process's token and
+the highest match id sent so far: a client reconnecting to the same process
+resumes exactly, with another process it resumes after the matches it has.
+
+An open stream holds a server thread (but no database connection) until it
+ends. At most LIVE_MAX_STREAMS streams are served per process, so the other
+threads stay free for the pages; the clients over the limit are told to come
+back later.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Max
+
+from ranking import engines, fragments, leaderboard
+from ranking.models import Match
+
+logger = logging.getLogger(__name__)
+
+# Seconds between comments that keep idle connections from being closed by proxies
+KEEPALIVE_INTERVAL = 15
+# Milliseconds after which a client turned away for too many streams reconnects
+BUSY_RETRY = 30000
+
+# `match` is the id of the match the event is about, None for `ranking` events
+Event = namedtuple('Event', ['seq', 'match', 'name', 'data', 'id'])
+
+
+def get_lookback():
+    return getattr(settings, 'LIVE_LOOKBACK', 100)
+
+
+class Hub(object):
+    def __init__(self, size=50):
+        self.token = uuid4().hex[:8]
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.wakeup = threading.Event()
+        self.seq = 0
+        # events up to this number, and matches up to this id, are not (or no longer) buffered
+        self.dropped_seq = 0
+        self.dropped_id = None
+        # the highest match id seen, and the ids seen within LIVE_LOOKBACK of it
+        self.high_id = None
+        self.seen = set()
+        self.ranking_version = None
+        self.thread = None
+        self.num_streams = 0
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.dropped_id = self.high_id = Match.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+            self.seen = set(Match.objects.filter(id__gt=self.high_id - get_lookback()).values_list('id', flat=True))
+            self.ranking_version = leaderboard.get_version()
+            self.thread = threading.Thread(target=self.run, name='live-feed-hub', daemon=True)
+            self.thread.start()
+
+    def open_stream(self):
+        """Count a new stream, unless LIVE_MAX_STREAMS are open already"""
+        with self.condition:
+            if self.num_streams >= getattr(settings, 'LIVE_MAX_STREAMS', 48):
+                return False
+            self.num_streams += 1
+            return True
+
+    def close_stream(self):
+        with self.condition:
+            self.num_streams -= 1
+
+    def notify(self, **kwargs):
+        """Receiver for `ratings_changed`: look for new matches and leaderboard changes now"""
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(getattr(settings, 'LIVE_POLL_INTERVAL', 5))
+            self.wakeup.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('LIVE: looking for new matches failed')
+            finally:
+                close_old_connections()
+
+    def refresh(self):
+        size = self.events.maxlen
+        # read before the leaderboard, a change while it is built is caught next time
+        version = leaderboard.get_version()
+        matches = list(Match.objects.prefetch_related(None).filter(id__gt=self.high_id - get_lookback()).exclude(
+            id__in=self.seen).order_by('id')[:size])
+        if len(matches) == size:
+            # there may be more, e.g. after an import
+            self.wakeup.set()
+        if not matches and version == self.ranking_version:
+            return
+        engine = engines.get_engine()
+        ranking = [
+            {'name': p.name, 'slug': p.slug, 'rating': round(p.rating), 'rank': p.rank}
+            for p in leaderboard.get_leaderboard(engine)
+        ]
+        if matches:
+            events = [
+                (match.pk, 'match', json.dumps({
+                    'match': fragments.render_matches([match]), 'rating': engine.name, 'ranking': ranking,
+                }))
+                for match in matches
+            ]
+        else:
+            events = [(None, 'ranking', json.dumps({'rating': engine.name, 'ranking': ranking}))]
+        self.ranking_version = version
+        self.publish(events)
+
+    def publish(self, events):
+        """Buffer (match id, event, data) events and wake up the streams"""
+        with self.condition:
+            for match_id, name, data in events:
+                if match_id is not None:
+                    self.seen.add(match_id)
+                    self.high_id = max(self.high_id, match_id)
+                if len(self.events) == self.events.maxlen:
+                    dropped = self.events[0]
+                    self.dropped_seq = dropped.seq
+                    if dropped.match is not None:
+                        self.dropped_id = max(self.dropped_id, dropped.match)
+                self.seq += 1
+                self.events.append(Event(self.seq, match_id, name, data,
+                                         '{}-{}-{}'.format(self.token, self.seq, self.high_id)))
+            floor = self.high_id - get_lookback()
+            self.seen = {pk for pk in self.seen if pk > floor}
+            self.condition.notify_all()
+
+    def resume(self, event_id):
+        """
+        Where to continue a stream, given the id of the client's last event.
+
+        Returns the number of the last event the client has, with the buffered
+        events to send before the ones after it. None if the client missed
+        events that are not buffered anymore.
+        """
+        parts = (event_id or '').split('-')
+        with self.condition:
+            if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+                # a new client
+                return self.seq, []
+            token, seq, high_id = parts[0], int(parts[1]), int(parts[2])
+            if token == self.token:
+                return (seq, []) if seq >= self.dropped_seq else None
+            # the client comes from another process, send the newer matches it cannot have
+            if high_id < self.dropped_id:
+                return None
+            return self.seq, [e for e in self.events if e.match is not None and e.match > high_id]
+
+    def since(self, seq):
+        """The events after number `seq`, or None if some of them are not buffered anymore"""
+        with self.condition:
+            if seq < self.dropped_seq:
+                return None
+            return [event for event in self.events if event.seq > seq]
+
+    def wait(self, seq, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > seq, timeout)
+        return self.since(seq)
+
+
+HUB = Hub()
+
+
+def format_event(event, data, id=None):
+    lines = ['event: {}'.format(event), 'data: {}'.format(data)]
+    if id is not None:
+        lines.insert(0, 'id: {}'.format(id))
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(last_event_id=None, hub=HUB):
+    """
+    The lines of one event stream connection.
+
+    Connections end after LIVE_STREAM_SECONDS so they do not tie up a server
+    thread forever; the browser reconnects and resumes from its last event.
+    A client that missed more events than are buffered is told to reload.
+    """
+    if not hub.open_stream():
+        logger.warning('LIVE: too many open streams, client asked to retry later')
+        yield 'retry: {}\n\n'.format(BUSY_RETRY)
+        return
+    try:
+        hub.start()
+        resumed = hub.resume(last_event_id)
+        # the events come from the hub, do not keep the request's connections open while waiting
+        connections.close_all()
+        yield 'retry: 5000\n\n'
+        if resumed is None:
+            yield format_event('reload', '{}')
+            return
+        seq, backlog = resumed
+        for event in backlog:
+            yield format_event(event.name, event.data, id=event.id)
+        deadline = time.monotonic() + getattr(settings, 'LIVE_STREAM_SECONDS', 300)
+        while time.monotonic() < deadline:
+            events = hub.wait(seq, min(KEEPALIVE_INTERVAL, max(deadline - time.monotonic(), 0)))
+            if events is None:
+                yield format_event('reload', '{}')
+                return
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                seq = event.seq
+                yield format_event(event.name, event.data, id=event.id)
+    finally:
+        hub.close_stream()
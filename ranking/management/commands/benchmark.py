@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ranking.benchmark.runner import Benchmark, compare, load_report, make_report, write_report
+from ranking.benchmark.synthetic import generate_club
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic club in a throwaway test database and time the hot views '
+        'and the rating replays; writes a JSON report that can be compared between runs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=100)
+        parser.add_argument('--matches', type=int, default=10000)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Zipf exponent of the player activity (0 = everybody plays equally often)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='timed runs per scenario')
+        parser.add_argument('--cold-cache', action='store_true', help='clear the cache before every run')
+        parser.add_argument('--only', nargs='*', help='run only these scenarios')
+        parser.add_argument('--output', help='write the JSON report to this file')
+        parser.add_argument('--compare', help='previous JSON report to compare against')
+
+    def handle(self, *args, **options):
+        config = {key: options[key] for key in ('players', 'matches', 'skew', 'seed', 'repeat', 'cold_cache')}
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write('Generating {players} players and {matches} matches...'.format(**config))
+            players = generate_club(options['players'], options['matches'], options['skew'], seed=options['seed'])
+            results = Benchmark(players, options['repeat'], options['cold_cache']).run(options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = make_report(config, results)
+        for name, result in results.items():
+            self.stdout.write('{:<16} {:>4} queries  p50 {:>9.2f}ms  p90 {:>9.2f}ms  p99 {:>9.2f}ms'.format(
+                name, result['queries'], result['p50_ms'], result['p90_ms'], result['p99_ms']))
+
+        if options['compare']:
+            self.stdout.write('\nCompared to {}:'.format(options['compare']))
+            for name, metric, before, after, change in compare(load_report(options['compare']), report):
+                self.stdout.write('{:<16} {:<8} {:>10} -> {:>10} ({:+.1%})'.format(name, metric, before, after, change))
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS('Report written to {}'.format(options['output'])))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ranking.models import Season
+
+
+class Command(BaseCommand):
+    help = 'Freeze the standings of all seasons that have ended (run it daily, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('seasons', nargs='*', metavar='slug',
+                            help='freeze these seasons, also again, instead of the ended ones')
+
+    def handle(self, *args, **options):
+        if options['seasons']:
+            seasons = Season.objects.filter(slug__in=options['seasons'])
+        else:
+            seasons = Season.objects.filter(closed=False, end__lt=timezone.now())
+        for season in seasons:
+            num_standings = season.close()
+            self.stdout.write(self.style.SUCCESS('Closed {} with {} players'.format(season, num_standings)))
@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ranking import elo, engines
+from ranking.models import HeadToHead, Job, Match, MatchParticipation, Player, PlayerStats
+
+FIELDS = ['date', 'player', 'player_score', 'opponent', 'opponent_score']
+
+
+def read_csv(f):
+    for row in csv.DictReader(f):
+        yield row
+
+
+def read_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical results from CSV or JSON lines with the fields {}, '
+        'then replay the Elo ratings and rebuild the statistics once'.format(', '.join(FIELDS))
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row, or a .jsonl file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='input format (default: guessed from the file extension)')
+        parser.add_argument('--create-players', action='store_true',
+                            help='create unknown players (without a usable password) instead of failing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.check_recording()
+        fmt = options['format'] or ('jsonl' if os.path.splitext(options['path'])[1] in ('.jsonl', '.ndjson') else 'csv')
+        reader = read_jsonl if fmt == 'jsonl' else read_csv
+        self.create_players = options['create_players']
+        self.players = Player.objects.slug_map()
+
+        start = time.perf_counter()
+        num_matches = 0
+        with open(options['path'], newline='' if fmt == 'csv' else None, encoding='utf-8') as f:
+            rows = enumerate(reader(f), start=1)
+            with transaction.atomic():
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    self.import_batch(batch)
+                    num_matches += len(batch)
+                self.reset_sequences()
+                num_replayed, num_deltas, num_ratings, _ = elo.recompute()
+                # once more while recompute holds off new reports
+                self.check_recording()
+                PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+                engines.enqueue_batches()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} matches and replayed {} matches ({} deltas, {} ratings changed) in {:.2f}s'.format(
+                num_matches, num_replayed, num_deltas, num_ratings, time.perf_counter() - start)
+        ))
+
+    def check_recording(self):
+        """The statistics are rebuilt, pending record_match jobs would count their matches twice"""
+        if Job.objects.unfinished('record_match').exists():
+            raise CommandError('Reported matches are still being recorded, try again after run_jobs')
+
+    def import_batch(self, batch):
+        results = [self.parse_row(line, row) for line, row in batch]
+        matches = []
+        for date, player, player_score, opponent, opponent_score in results:
+            # the first participation wins ties, like for reported results
+            winner, loser = (opponent, player) if opponent_score > player_score else (player, opponent)
+            matches.append(Match(date=date, winner_id=winner, loser_id=loser,
+                                 num_legs=player_score + opponent_score))
+
+        if not connection.features.can_return_ids_from_bulk_insert:
+            # the backend does not hand out the new ids, so assign them here
+            next_id = (Match.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+            for i, match in enumerate(matches):
+                match.pk = next_id + i
+        Match.objects.bulk_create(matches)
+
+        participations = []
+        for match, (_, player, player_score, opponent, opponent_score) in zip(matches, results):
+            participations.append(MatchParticipation(match=match, player_id=player, score=player_score, delta=0))
+            participations.append(MatchParticipation(match=match, player_id=opponent, score=opponent_score, delta=0))
+        MatchParticipation.objects.bulk_create(participations)
+
+    def parse_row(self, line, row):
+        try:
+            date = parse_datetime(row['date']) or datetime.combine(parse_date(row['date']), datetime.min.time())
+            if timezone.is_naive(date):
+                date = timezone.make_aware(date)
+            player = self.get_player(row['player'])
+            opponent = self.get_player(row['opponent'])
+            player_score = int(row['player_score'])
+            opponent_score = int(row['opponent_score'])
+        except (KeyError, TypeError, ValueError, ValidationError) as e:
+            raise CommandError('Invalid row {}: {!r} ({})'.format(line, row, e))
+        if player == opponent:
+            raise CommandError('Invalid row {}: a player cannot play against themselves'.format(line))
+        if player_score < 0 or opponent_score < 0:
+            raise CommandError('Invalid row {}: scores must not be negative'.format(line))
+        return date, player, player_score, opponent, opponent_score
+
+    def get_player(self, name):
+        slug = Player.objects.name_to_slug(name)
+        try:
+            return self.players[slug]
+        except KeyError:
+            if not self.create_players:
+                raise ValueError('unknown player {!r}'.format(name))
+        player = Player(name=name, slug=slug)
+        player.set_password(None)
+        player.full_clean(exclude=['pw_hash'])
+        player.save()
+        self.players[slug] = player.pk
+        return player.pk
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(no_style(), [Match, MatchParticipation])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
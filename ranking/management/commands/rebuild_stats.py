@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ranking.models import HeadToHead, Job, Player, PlayerStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the player statistics and head-to-head tables from the full match history'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # reports wait until the rebuild is stored, like for elo.recompute
+            list(Player.objects.select_for_update().order_by('pk').values_list('id', flat=True))
+            if Job.objects.unfinished('record_match').exists():
+                # the rebuild would count their matches, and the jobs then once more
+                raise CommandError('Reported matches are still being recorded, try again after run_jobs')
+            head_to_heads = HeadToHead.objects.rebuild()
+            num_players = PlayerStats.objects.rebuild(head_to_heads)
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt statistics for {} players and {} head-to-head records'.format(num_players, len(head_to_heads))
+        ))
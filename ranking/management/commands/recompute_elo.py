@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ranking import elo
+
+
+class Command(BaseCommand):
+    help = 'Replay the Elo ratings over the full match history and store the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k-factor', type=float, default=elo.K_FACTOR,
+                            help='Elo K-factor (default: %(default)s)')
+        parser.add_argument('--initial', type=float, default=elo.INITIAL_ELO,
+                            help='rating of a player without matches (default: %(default)s)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report what would change')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        num_matches, num_deltas, num_players, num_snapshots = elo.recompute(
+            k_factor=options['k_factor'], initial=options['initial'], dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            '{} {} match deltas, {} player ratings and {} rating snapshots after replaying {} matches in {:.2f}s'.format(
+                'Would write' if options['dry_run'] else 'Wrote', num_deltas, num_players, num_snapshots,
+                num_matches, elapsed)
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ranking import glicko
+
+
+class Command(BaseCommand):
+    help = 'Rate the full match history with Glicko-2, period by period, and store the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period-days', type=int,
+                            default=getattr(settings, 'GLICKO_PERIOD_DAYS', glicko.PERIOD_DAYS),
+                            help='length of a rating period in days (default: %(default)s)')
+        parser.add_argument('--tau', type=float, default=glicko.TAU,
+                            help='system constant constraining the volatility (default: %(default)s)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report what would change')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        num_matches, num_periods, num_players = glicko.recompute(
+            period_days=options['period_days'], tau=options['tau'], dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            '{} {} player ratings after rating {} matches in {} periods in {:.2f}s'.format(
+                'Would write' if options['dry_run'] else 'Wrote', num_players, num_matches, num_periods, elapsed)
+        ))
@@ -0,0 +1,63 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from ranking import jobs, metrics
+from ranking.models import Job
+
+
+def run_job(job):
+    # every thread keeps its own connection, treat each job like a request
+    close_old_connections()
+    try:
+        return jobs.run(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Work off the job queue with a pool of threads until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='jobs run in parallel; 1 runs them in the main thread (default: %(default)s)')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='seconds to wait when the queue is empty (default: %(default)s)')
+        parser.add_argument('--once', action='store_true',
+                            help='exit as soon as no job is due')
+
+    def handle(self, *args, **options):
+        self.stopped = False
+        signal.signal(signal.SIGTERM, self.stop)
+        threads = options['threads']
+        if connection.vendor == 'sqlite':
+            # SQLite allows only one writing transaction at a time
+            threads = 1
+        timeout = getattr(settings, 'JOB_TIMEOUT', 300)
+        pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        succeeded = failed = 0
+        try:
+            while not self.stopped:
+                claimed = Job.objects.claim(threads, timeout)
+                results = list(pool.map(run_job, claimed) if pool else map(jobs.run, claimed))
+                succeeded += results.count(True)
+                failed += results.count(False)
+                metrics.REGISTRY.flush()
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS('Ran {} jobs, {} failed'.format(succeeded, failed)))
+
+    def stop(self, signum, frame):
+        # finish the running jobs, then exit
+        self.stopped = True
@@ -0,0 +1,109 @@
+"""
+Opponent suggestions for a player, among the players who played recently.
+
+Balanced opponents are the ones the player's Elo gives the closest to even
+chances against. Informative ones are those whose matches tell the most about
+the player's Glicko-2 rating, see glicko.information.
+
+The active players, the matrix of their win probabilities against each other
+and every player's suggestions are cached under a version token that is
+replaced whenever ratings or statistics change. The matrix is computed once
+per version, an active player's chances are their row of it.
+"""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from ranking import glicko
+from ranking.elo import expected_score, win_probabilities
+from ranking.metrics import record_cache
+from ranking.models import Player
+
+BALANCED = 'balanced'
+INFORMATIVE = 'informative'
+MODES = (BALANCED, INFORMATIVE)
+NUM_SUGGESTIONS = 5
+VERSION_KEY = 'matchmaking:version'
+PLAYERS_KEY = 'matchmaking:players:{}'
+SUGGESTIONS_KEY = 'matchmaking:suggestions:{}:{}:{}:{}'
+
+
+def get_timeout():
+    return getattr(settings, 'LEADERBOARD_CACHE_TIMEOUT', 300)
+
+
+def get_active_players():
+    """
+    The players with a match in the last MATCHMAKING_ACTIVE_DAYS and their win probabilities.
+
+    Returns a (players, matrix) tuple: players are (id, name, slug, elo, glicko,
+    glicko deviation) tuples, row i of the matrix holds player i's expected
+    score against each of them. Both are cached together, so they always match.
+    """
+    key = PLAYERS_KEY.format(get_version())
+    active = cache.get(key)
+    record_cache('matchmaking_players', active is not None)
+    if active is None:
+        since = timezone.now() - timedelta(days=getattr(settings, 'MATCHMAKING_ACTIVE_DAYS', 90))
+        # read from the primary like the leaderboard, a lagging replica would keep old ratings cached
+        players = list(Player.objects.using(DEFAULT_DB_ALIAS).filter(stats__last_match__gte=since).order_by(
+            'id').values_list('id', 'name', 'slug', 'elo', 'glicko', 'glicko_deviation'))
+        active = players, win_probabilities([p[3] for p in players])
+        cache.set(key, active, get_timeout())
+    return active
+
+
+def suggest(player, mode=BALANCED, limit=NUM_SUGGESTIONS):
+    """
+    The best opponents for `player` by `mode`, best first.
+
+    Each one is a dict with the opponent's `name`, `slug`, `elo` and the
+    player's `win_probability` against them.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown matchmaking mode {}'.format(mode))
+    key = SUGGESTIONS_KEY.format(get_version(), mode, limit, player.pk)
+    suggestions = cache.get(key)
+    record_cache('matchmaking', suggestions is not None)
+    if suggestions is None:
+        suggestions = _suggest(player, *get_active_players(), mode=mode, limit=limit)
+        cache.set(key, suggestions, get_timeout())
+    return suggestions
+
+
+def _suggest(player, players, matrix, mode, limit):
+    index = next((i for i, p in enumerate(players) if p[0] == player.pk), None)
+    opponents = [p for i, p in enumerate(players) if i != index]
+    if not opponents:
+        return []
+    if index is None:
+        # not active, so not in the matrix
+        rating = player.glicko
+        probabilities = expected_score(player.elo, [p[3] for p in opponents])
+    else:
+        # the cached ratings are from the primary, the player may have been read from a replica
+        rating = players[index][4]
+        probabilities = [q for i, q in enumerate(matrix[index]) if i != index]
+    if mode == BALANCED:
+        scores = [-abs(probability - 0.5) for probability in probabilities]
+    else:
+        scores = [glicko.information(rating, p[4], p[5]) for p in opponents]
+    best = sorted(range(len(opponents)), key=lambda i: (-scores[i], opponents[i][1]))[:limit]
+    return [
+        {'name': opponents[i][1], 'slug': opponents[i][2], 'elo': round(opponents[i][3]),
+         'win_probability': round(probabilities[i], 3)}
+        for i in best
+    ]
+
+
+def get_version():
+    """Token that changes whenever the suggestions are invalidated"""
+    return cache.get_or_set(VERSION_KEY, lambda: uuid4().hex, None)
+
+
+def invalidate(**kwargs):
+    transaction.on_commit(lambda: cache.delete(VERSION_KEY))
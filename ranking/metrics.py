@@ -0,0 +1,310 @@
+"""
+A small Prometheus style metrics registry.
+
+Counters and histograms are kept per process. If METRICS_DIR is set, every
+process also dumps its values into its own file in that directory (after
+requests, at most every METRICS_FLUSH_INTERVAL seconds, and on exit), and
+/metrics sums the files of all processes, so
+the numbers are correct across gunicorn workers. When scraped, the files of
+exited workers are merged into one, so counters never go backwards and the
+directory does not grow with every restart. Gauges are computed when scraped.
+"""
+import atexit
+import errno
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows, the files of exited workers are kept there
+    fcntl = None
+
+from django.conf import settings
+from django.db import models
+from django.http import HttpResponse
+
+# Values of the exited processes, merged from their files
+EXITED_FILE = 'metrics-exited.json'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in labels) + '}'
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.registry = registry
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} expects the labels {}'.format(self.name, self.labelnames))
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.registry.dirty = True
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # per bucket counts (the last one is +Inf), then the sum
+            state = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+            self.registry.dirty = True
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, values):
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket', key + (('le', le),), cumulative
+            yield self.name + '_sum', key, state[-1]
+            yield self.name + '_count', key, cumulative
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+        self.gauges = []
+        self.lock = threading.Lock()
+        # held while this process's file is written, the threads of a worker share it
+        self.flush_lock = threading.Lock()
+        self.flushed = 0
+        self.dirty = False
+        self._pid = None
+        self._path = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def gauge(self, func):
+        """Register a function returning (name, documentation, {labels tuple: value}) at scrape time"""
+        self.gauges.append(func)
+        return func
+
+    def _own_path(self, directory):
+        pid = os.getpid()
+        if self._pid != pid:
+            if self._pid is not None:
+                # forked: the values belong to the parent process
+                for metric in self.metrics.values():
+                    metric.values = {}
+            self._pid = pid
+            self._path = os.path.join(directory, 'metrics-{}-{}.json'.format(pid, uuid.uuid4().hex[:8]))
+        elif os.path.dirname(self._path) != directory:
+            self._path = os.path.join(directory, os.path.basename(self._path))
+        return self._path
+
+    def _encode(self, values):
+        return [[list(map(list, key)), value] for key, value in values.items()]
+
+    def flush(self, interval=0):
+        """
+        Write this process's values to its file in METRICS_DIR.
+
+        Nothing is written if the file was written less than `interval` seconds
+        ago, or if another thread is writing it right now; the values stay dirty
+        for the next flush then.
+        """
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory or not self.dirty or time.monotonic() - self.flushed < interval:
+            return
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                path = self._own_path(directory)
+                data = {name: self._encode(metric.values) for name, metric in self.metrics.items()}
+                self.dirty = False
+            self.flushed = time.monotonic()
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        finally:
+            self.flush_lock.release()
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _add(self, totals, data):
+        for name, values in data.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            for key, value in values:
+                key = tuple(tuple(pair) for pair in key)
+                totals.setdefault(name, {})[key] = metric.merge(totals.get(name, {}).get(key), value)
+
+    def _merge_exited(self, directory):
+        """Merge the files of the processes that are not running anymore into EXITED_FILE"""
+        exited = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*-*.json')):
+            pid = os.path.basename(path).split('-')[1]
+            if pid.isdigit() and not _is_running(int(pid)):
+                exited.append(path)
+        if not exited:
+            return
+        path = os.path.join(directory, EXITED_FILE)
+        totals = {}
+        for name in [path] + exited:
+            self._add(totals, self._read(name))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({name: self._encode(values) for name, values in totals.items()}, f)
+        os.replace(tmp, path)
+        for name in exited:
+            os.remove(name)
+
+    def collect(self):
+        """Values of all metrics, summed over all processes"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            with self.lock:
+                return {name: dict(metric.values) for name, metric in self.metrics.items()}
+
+        self.flush()
+        os.makedirs(directory, exist_ok=True)
+        totals = {name: {} for name in self.metrics}
+        with open(os.path.join(directory, 'metrics.lock'), 'w') as lock:
+            # one scrape at a time, so no exited process is merged twice or read while it is merged
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._merge_exited(directory)
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                self._add(totals, self._read(path))
+        return totals
+
+    def render(self):
+        lines = []
+        for name, values in sorted(self.collect().items()):
+            metric = self.metrics[name]
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            for sample, key, value in metric.samples(values):
+                lines.append('{}{} {}'.format(sample, _format_labels(key), value))
+        for func in self.gauges:
+            name, documentation, values = func()
+            lines.append('# HELP {} {}'.format(name, documentation))
+            lines.append('# TYPE {} gauge'.format(name))
+            for key, value in sorted(values.items()):
+                lines.append('{}{} {}'.format(name, _format_labels(key), value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+REQUEST_LATENCY = Histogram(REGISTRY, 'dart_request_duration_seconds', 'Request latency by view',
+                            ['view', 'method'])
+MATCHES_REPORTED = Counter(REGISTRY, 'dart_matches_reported_total', 'Results reported through the website')
+LOGINS = Counter(REGISTRY, 'dart_logins_total', 'Login attempts by result', ['result'])
+ELO_RECOMPUTATIONS = Counter(REGISTRY, 'dart_elo_recomputations_total', 'Full Elo history replays')
+CACHE_REQUESTS = Counter(REGISTRY, 'dart_cache_requests_total', 'Cache lookups by cache and result',
+                         ['cache', 'result'])
+JOBS_PROCESSED = Counter(REGISTRY, 'dart_jobs_processed_total', 'Jobs run by the workers by job and result',
+                         ['job', 'result'])
+
+
+@REGISTRY.gauge
+def _object_counts():
+    from ranking.models import Match, Player
+    return 'dart_objects', 'Number of stored objects by model', {
+        (('model', 'player'),): Player.objects.count(),
+        (('model', 'match'),): Match.objects.count(),
+    }
+
+
+@REGISTRY.gauge
+def _job_counts():
+    from ranking.models import Job
+    counts = dict(Job.objects.values_list('status').annotate(count=models.Count('id')))
+    return 'dart_jobs', 'Number of queued jobs by status', {
+        (('status', status),): counts.get(status, 0) for status, _ in Job.STATUS_CHOICES
+    }
+
+
+def record_cache(cache_name, hit):
+    CACHE_REQUESTS.inc(cache=cache_name, result='hit' if hit else 'miss')
+
+
+class MetricsMiddleware(object):
+    """Observes the latency of every request and writes this process's metrics file"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        REQUEST_LATENCY.observe(time.perf_counter() - start,
+                                view=match.view_name if match else 'unresolved', method=request.method)
+        REGISTRY.flush(interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 1))
+        return response
+
+
+def metrics_view(request):
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
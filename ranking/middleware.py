@@ -0,0 +1,33 @@
+from ranking import routers
+from ranking.support import get_request_player
+
+
+class SessionPlayerMiddleware(object):
+    """Attaches the lazily resolved session player to `request.player`"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        get_request_player(request)
+        return self.get_response(request)
+
+
+class ReplicaMiddleware(object):
+    """
+    Chooses the read replica for views declared with `read_replica`.
+
+    The choice is reset when the next request starts rather than when the
+    response is returned, so streamed responses keep reading from it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.set_replica(None)
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if routers.uses_replica(view_func):
+            routers.set_replica(routers.choose_replica(request))
@@ -0,0 +1,81 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_statistics(apps, schema_editor):
+    """Count the existing matches like the rebuild_stats command; ties go to the older participation"""
+    MatchParticipation = apps.get_model('ranking', 'MatchParticipation')
+    PlayerStats = apps.get_model('ranking', 'PlayerStats')
+    HeadToHead = apps.get_model('ranking', 'HeadToHead')
+    alias = schema_editor.connection.alias
+
+    rows = MatchParticipation.objects.using(alias).order_by('match_id', 'id').values_list(
+        'match_id', 'match__date', 'player_id', 'score')
+    matches = {}
+    for match_id, date, player_id, score in rows.iterator():
+        matches.setdefault(match_id, (date, []))[1].append((player_id, score))
+
+    stats = {}
+    head_to_heads = {}
+    for date, participants in matches.values():
+        for player_id, _ in participants:
+            player_stats = stats.setdefault(player_id, PlayerStats(player_id=player_id))
+            if player_stats.last_match is None or date > player_stats.last_match:
+                player_stats.last_match = date
+        if len(participants) != 2:
+            continue
+        (p1, s1), (p2, s2) = participants
+        for player, opponent, won, legs_won, legs_lost in ((p1, p2, s1 >= s2, s1, s2), (p2, p1, s2 > s1, s2, s1)):
+            h2h = head_to_heads.setdefault((player, opponent), HeadToHead(player_id=player, opponent_id=opponent))
+            for record in (stats[player], h2h):
+                record.legs_won += legs_won
+                record.legs_lost += legs_lost
+            stats[player].matches_won += won
+            stats[player].matches_lost += not won
+            h2h.wins += won
+            h2h.losses += not won
+
+    PlayerStats.objects.using(alias).bulk_create(stats.values(), batch_size=100)
+    HeadToHead.objects.using(alias).bulk_create(head_to_heads.values(), batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='ranking.Player')),
+                ('matches_won', models.PositiveIntegerField(default=0)),
+                ('matches_lost', models.PositiveIntegerField(default=0)),
+                ('legs_won', models.PositiveIntegerField(default=0)),
+                ('legs_lost', models.PositiveIntegerField(default=0)),
+                ('last_match', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'player stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='HeadToHead',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('legs_won', models.PositiveIntegerField(default=0)),
+                ('legs_lost', models.PositiveIntegerField(default=0)),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ranking.Player')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='head_to_heads', to='ranking.Player')),
+            ],
+            options={
+                'unique_together': {('player', 'opponent')},
+            },
+        ),
+        migrations.RunPython(fill_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0002_player_stats_head_to_head'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['-date', '-id'], name='ranking_match_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0003_match_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('elo', models.FloatField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='ranking.Match')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_history', to='ranking.Player')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ratingsnapshot',
+            index=models.Index(fields=['player', 'date'], name='ranking_rating_player_date_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ratingsnapshot',
+            unique_together={('match', 'player')},
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_results(apps, schema_editor):
+    """Copy winner, loser and number of legs from the participations; ties go to the older participation"""
+    Match = apps.get_model('ranking', 'Match')
+    MatchParticipation = apps.get_model('ranking', 'MatchParticipation')
+
+    rows = MatchParticipation.objects.using(schema_editor.connection.alias).order_by('match_id', 'id').values_list(
+        'match_id', 'player_id', 'score')
+    results = {}
+    for match_id, player_id, score in rows.iterator():
+        results.setdefault(match_id, []).append((player_id, score))
+
+    batch = []
+    for match_id, participants in results.items():
+        if len(participants) != 2:
+            continue
+        (p1, s1), (p2, s2) = participants
+        winner, loser = (p2, p1) if s2 > s1 else (p1, p2)
+        batch.append((match_id, winner, loser, s1 + s2))
+        if len(batch) == 100:
+            _update(Match, schema_editor.connection.alias, batch)
+            batch = []
+    if batch:
+        _update(Match, schema_editor.connection.alias, batch)
+
+
+def _update(Match, alias, batch):
+    def case(index):
+        return models.Case(
+            *[models.When(pk=row[0], then=models.Value(row[index])) for row in batch],
+            output_field=models.IntegerField(),
+        )
+    Match.objects.using(alias).filter(pk__in=[row[0] for row in batch]).update(
+        winner_id=case(1), loser_id=case(2), num_legs=case(3))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0004_rating_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='loser',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lost_matches', to='ranking.Player'),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='num_legs',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='winner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='won_matches', to='ranking.Player'),
+        ),
+        migrations.RunPython(fill_results, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['winner', '-date'], name='ranking_match_winner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['loser', '-date'], name='ranking_match_loser_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matchparticipation',
+            index=models.Index(fields=['player', 'match'], name='ranking_part_player_match_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+INDEX_NAME = 'ranking_player_slug_trgm_idx'
+
+
+def create_trigram_index(apps, schema_editor):
+    """Substring searches on the slug can only use an index on PostgreSQL"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX {} ON ranking_player USING gin (slug gin_trgm_ops)'.format(INDEX_NAME))
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0005_match_result'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
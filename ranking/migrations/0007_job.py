@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 01:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0006_player_slug_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('arguments', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('pending', 'Wartend'), ('running', 'Läuft'), ('failed', 'Fehlgeschlagen')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'], name='ranking_job_status_run_idx'),
+        ),
+    ]
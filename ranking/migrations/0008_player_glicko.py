@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='glicko',
+            field=models.FloatField(default=1500),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='glicko_deviation',
+            field=models.FloatField(default=350),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='glicko_volatility',
+            field=models.FloatField(default=0.06),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0008_player_glicko'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Season',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(unique=True)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('closed', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['-start'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SeasonStanding',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('elo', models.FloatField()),
+                ('num_matches', models.PositiveIntegerField()),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='season_standings', to='ranking.Player')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='ranking.Season')),
+            ],
+            options={
+                'unique_together': {('season', 'player')},
+            },
+        ),
+    ]
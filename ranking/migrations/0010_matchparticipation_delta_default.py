@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0009_season'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='matchparticipation',
+            name='delta',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,20 +1,34 @@
+import json
+from datetime import timedelta
+
 from django.contrib.auth.hashers import (
     check_password, make_password,
 )
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models import Prefetch
+from django.db import connections, router, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Greatest, Rank
 from django.utils import timezone
 from django.utils.text import slugify
-from collections import defaultdict
+
+from ranking.elo import INITIAL_ELO, K_FACTOR, expected_score
+from ranking.glicko import INITIAL_DEVIATION, INITIAL_RATING, INITIAL_VOLATILITY
+from ranking.signals import ratings_changed
 
 
 class PlayerQuerySet(models.QuerySet):
     @staticmethod
-    def _update_kwargs(kwargs):
+    def name_to_slug(name):
+        """Players are looked up by the slug of their name"""
+        return slugify(name)
+
+    @classmethod
+    def _update_kwargs(cls, kwargs):
         if 'name' in kwargs:
-            kwargs['slug'] = slugify(kwargs['name'])
+            kwargs['slug'] = cls.name_to_slug(kwargs['name'])
             del kwargs['name']
 
     def filter(self, *args, **kwargs):
@@ -25,18 +39,129 @@ class PlayerQuerySet(models.QuerySet):
         self._update_kwargs(kwargs)
         return super().get(*args, **kwargs)
 
+    def slug_map(self):
+        """Map the players' slugs to their primary keys"""
+        return dict(self.values_list('slug', 'id'))
+
+    def lock(self, pks):
+        """
+        Lock the given players' rows until the end of the transaction.
+
+        The rows are locked in primary key order so that concurrent reports
+        cannot deadlock. Returns a dict mapping the pks to fresh instances.
+        """
+        return {p.pk: p for p in self.select_for_update().filter(pk__in=pks).order_by('pk')}
+
+    def search(self, term):
+        """
+        Players whose slug contains the slugified term, those starting with it first.
+
+        The slug is the normalized name, so names match regardless of case and
+        accents. The prefix lookups use the slug's index, the substring lookups
+        the trigram index on PostgreSQL.
+        """
+        term = self.name_to_slug(term)
+        if not term:
+            return self.none()
+        return self.filter(slug__contains=term).annotate(
+            is_prefix=Case(When(slug__startswith=term, then=Value(True)), default=Value(False),
+                           output_field=models.BooleanField())
+        ).order_by('-is_prefix', 'slug')
+
+    def as_of(self, date, since=None):
+        """
+        The Elo every player had at `date`, ranked like `ranked` by the annotated `rating`.
+
+        The rating is the one right after the player's last match at or before
+        `date`, read from the rating snapshots on their (player, date) index, all
+        in one query. Players without a match by then are left out, with `since`
+        also the ones without a match from then on.
+        """
+        latest = RatingSnapshot.objects.filter(player=OuterRef('pk'), date__lte=date).order_by('-date', '-match_id')
+        players = self.annotate(rating=Subquery(latest.values('elo')[:1]), rated=Subquery(latest.values('date')[:1]))
+        players = players.filter(rated__gte=since) if since else players.filter(rated__isnull=False)
+        return players.annotate(
+            rank=Window(expression=Rank(), order_by=F('rating').desc())
+        ).order_by('-rating', 'name')
+
+    def ranked(self, field='elo'):
+        """Order by a rating field and annotate each player's `rank`; equal ratings share a rank"""
+        return self.annotate(
+            rank=Window(expression=Rank(), order_by=F(field).desc())
+        ).order_by('-' + field, 'name')
+
+
+class MatchParticipationQuerySet(models.QuerySet):
+    def head_to_head(self, opponents=None):
+        """
+        Aggregate the participations into one row per (player, opponent) pair.
+
+        The base table holds the player's participations, the join on the
+        match holds the opponent's. Ties are won by the participation that was
+        created first, just like in Match.get_result. `opponents` limits the
+        pairs to these opponent ids.
+        """
+        opponent = 'match__participations'
+        won = Q(score__gt=F(opponent + '__score')) | Q(
+            score=F(opponent + '__score'), id__lt=F(opponent + '__id'))
+        pairs = Q(**{opponent + '__id__lt': F('id')}) | Q(**{opponent + '__id__gt': F('id')})
+        if opponents is not None:
+            # in the same filter() as the pairs, so it constrains the same join
+            pairs &= Q(**{opponent + '__player__in': opponents})
+        return (self
+                .filter(pairs)
+                .values('player', opponent + '__player')
+                .annotate(wins=Count('id', filter=won),
+                          matches=Count('id'),
+                          legs_won=Sum('score'),
+                          legs_lost=Sum(opponent + '__score'))
+                .order_by())
+
 
 class FullMatchManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().order_by('-date').prefetch_related(
             Prefetch('participations', queryset=MatchParticipation.objects.select_related('player')))
 
+    def newest(self):
+        """(id, date) of the most recent match or None, answered from the date index"""
+        return self.get_queryset().prefetch_related(None).order_by('-date', '-id').values_list('id', 'date').first()
+
+    def report(self, player, opponent, player_score, opponent_score, date=None):
+        """
+        Create and rate a match in one transaction; the reporting player wins ties.
+
+        The statistics and rating snapshots are recorded by a job afterwards.
+        """
+        with transaction.atomic():
+            players = Player.objects.lock([player.pk, opponent.pk])
+            participations = [
+                MatchParticipation(player=players[player.pk], score=player_score, delta=0),
+                MatchParticipation(player=players[opponent.pk], score=opponent_score, delta=0),
+            ]
+            match = self.model(date=date or timezone.now())
+            match.set_result(*participations)
+            match.save()
+            # the deltas are known before inserting, so the participations are written only once
+            match.rate(*participations)
+            for pt in participations:
+                pt.match = match
+            MatchParticipation.objects.bulk_create(participations)
+            match.enqueue_recording(*participations)
+            player_ids = sorted(players)
+            transaction.on_commit(lambda: ratings_changed.send(sender=Match, players=player_ids))
+        return match
+
 
 class Player(models.Model):
     class Meta:
         default_manager_name = 'objects'
     objects = PlayerQuerySet.as_manager()
-    elo = models.FloatField(default=1000)
+    elo = models.FloatField(default=INITIAL_ELO)
+    # Glicko-2 rating, deviation and volatility, see ranking.glicko
+    glicko = models.FloatField(default=INITIAL_RATING)
+    glicko_deviation = models.FloatField(default=INITIAL_DEVIATION)
+    glicko_volatility = models.FloatField(default=INITIAL_VOLATILITY)
     name = models.CharField(max_length=30, unique=True,
                             validators=[
                                 RegexValidator(r'^[\w. @+-]+$', 'Der Name enthält ein ungültiges Zeichen', 'invalid')
@@ -45,9 +170,7 @@ class Player(models.Model):
     slug = models.SlugField(unique=True)
     _matches = []
     _participations = []
-    _num_legs_won = None
-    _num_legs_lost = None
-    _total_legs = None
+    _statistics = None
     _bogey = None
     _favorite = None
 
@@ -61,8 +184,8 @@ class Player(models.Model):
         return self.name
 
     def update_elo(self, expected_performance, victory):
-        self.elo = self.elo + 32 * (int(victory) - expected_performance)
-        self.save()
+        self.elo = self.elo + K_FACTOR * (int(victory) - expected_performance)
+        self.save(update_fields=['elo'])
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
@@ -70,15 +193,36 @@ class Player(models.Model):
 
     @property
     def matches_won(self):
-        return [m for m in self.matches if m.is_winner(self)]
+        return Match.objects.filter(winner=self)
 
     @property
     def matches_lost(self):
-        return [m for m in self.matches if not m.is_winner(self)]
+        return Match.objects.filter(loser=self)
+
+    @property
+    def statistics(self):
+        if self._statistics is None:
+            try:
+                self._statistics = self.stats
+            except PlayerStats.DoesNotExist:
+                self._statistics = PlayerStats(player=self)
+        return self._statistics
+
+    @property
+    def num_matches_won(self):
+        return self.statistics.matches_won
+
+    @property
+    def num_matches_lost(self):
+        return self.statistics.matches_lost
+
+    @property
+    def num_matches(self):
+        return self.num_matches_won + self.num_matches_lost
 
     def winrate(self):
         try:
-            return (float(len(self.matches_won)) / len(self.matches)) * 100
+            return (float(self.num_matches_won) / self.num_matches) * 100
         except ZeroDivisionError:
             return 0
 
@@ -90,21 +234,15 @@ class Player(models.Model):
 
     @property
     def num_legs_won(self):
-        if self._num_legs_won is None:
-            self._calculate_statistics()
-        return self._num_legs_won
+        return self.statistics.legs_won
 
     @property
     def num_legs_lost(self):
-        if self._num_legs_lost is None:
-            self._calculate_statistics()
-        return self._num_legs_lost
+        return self.statistics.legs_lost
 
     @property
     def total_legs(self):
-        if self._total_legs is None:
-            self._calculate_statistics()
-        return self._total_legs
+        return self.num_legs_won + self.num_legs_lost
 
     @property
     def legs_winrate(self):
@@ -113,17 +251,23 @@ class Player(models.Model):
         except ZeroDivisionError:
             return 0
 
+    # the opponents are ordered by (losses, -wins, name): the bogey is the last one if it has
+    # beaten the player, the favorite the first one if the player has beaten it
     @property
     def bogey(self):
-        if not self._bogey:
-            self._calculate_statistics()
-        return self._bogey
+        if self._bogey is None:
+            record = self.head_to_heads.order_by(
+                '-losses', 'wins', '-opponent__name').select_related('opponent').first()
+            self._bogey = self._get_stats_tuple_for_player(record if record and record.losses else None)
+        return self._bogey or None
 
     @property
     def favorite(self):
-        if not self._favorite:
-            self._calculate_statistics()
-        return self._favorite
+        if self._favorite is None:
+            record = self.head_to_heads.order_by(
+                'losses', '-wins', 'opponent__name').select_related('opponent').first()
+            self._favorite = self._get_stats_tuple_for_player(record if record and record.wins else None)
+        return self._favorite or None
 
     @property
     def participations(self):
@@ -131,75 +275,132 @@ class Player(models.Model):
             self._participations = MatchParticipation.objects.filter(player=self).select_related().prefetch_related()
         return self._participations
 
-    def _calculate_statistics(self):
-        print('CALCULATING STATS')
-
-        self._num_legs_lost = 0
-        self._num_legs_won = 0
-        self._total_legs = 0
-        player_stats = defaultdict(lambda: [0,0])
-        for m in self.matches:
-            self._total_legs += m.get_num_legs()
-            self._num_legs_won += m.get_score_for_player(self)
-            self._num_legs_lost += m.get_score_for_opponent(self)
-
-            index = int(not m.is_winner(self))
-
-            player_stats[m.get_opponent(self)][index] += 1
+    def _get_stats_tuple_for_player(self, record):
+        # an empty tuple marks "looked up, but there is none"
+        if record is None:
+            return ()
+        return (record.opponent, record.wins, record.losses, record.winrate)
 
-        print(player_stats)
-        sorted_stats = sorted(player_stats.items(), key=lambda i: (i[1][1], -i[1][0]))
-        if sorted_stats[-1][1][1] > 0:
-            self._bogey = self._get_stats_tuple_for_player(sorted_stats[-1])
-        if sorted_stats[0][1][0] > 0:
-            self._favorite = self._get_stats_tuple_for_player(sorted_stats[0])
-
-        #if len(losses_per_player) > 0:
-        #    self._bogey = sorted(losses_per_player.items(), key=lambda t: t[1])[0][0]
-        #else:
-        #    self._bogey = None
-
-    def _get_stats_tuple_for_player(self, item):
-        wins, losses = item[1]
-        return (item[0], wins, losses, (float(wins) / (wins + losses)) * 100)
 
 class Match(models.Model):
     class Meta:
         verbose_name_plural = 'matches'
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='ranking_match_date_id_idx'),
+            models.Index(fields=['winner', '-date'], name='ranking_match_winner_date_idx'),
+            models.Index(fields=['loser', '-date'], name='ranking_match_loser_date_idx'),
+        ]
     date = models.DateTimeField(default=timezone.now)
+    # denormalized from the participations, see set_result
+    winner = models.ForeignKey(Player, models.SET_NULL, null=True, blank=True, db_index=False,
+                               related_name='won_matches')
+    loser = models.ForeignKey(Player, models.SET_NULL, null=True, blank=True, db_index=False,
+                              related_name='lost_matches')
+    num_legs = models.PositiveIntegerField(null=True, blank=True)
     objects = FullMatchManager()
 
     def update_elos(self):
-        p1, p2 = self.players
-        exp_1 = 1 / (1 + 10 ** ((p2.elo - p1.elo) / 400))
+        """Rate an already stored match, e.g. one created through the admin"""
+        with transaction.atomic():
+            pt1, pt2 = self.participations.order_by('id')
+            players = Player.objects.lock([pt1.player_id, pt2.player_id])
+            pt1.player, pt2.player = players[pt1.player_id], players[pt2.player_id]
+
+            self.rate(pt1, pt2)
+            MatchParticipation.objects.filter(pk=pt1.pk).update(delta=pt1.delta)
+            MatchParticipation.objects.filter(pk=pt2.pk).update(delta=pt2.delta)
+            self.set_result(pt1, pt2)
+            Match.objects.filter(pk=self.pk).update(
+                winner_id=self.winner_id, loser_id=self.loser_id, num_legs=self.num_legs)
+
+            self.enqueue_recording(pt1, pt2)
+            player_ids = sorted(players)
+            transaction.on_commit(lambda: ratings_changed.send(sender=Match, players=player_ids))
+
+    def rate(self, pt1, pt2):
+        """Update both players' Elo and store the changes as the participations' deltas"""
+        p1, p2 = pt1.player, pt2.player
+        exp_1 = expected_score(p1.elo, p2.elo)
         exp_2 = 1 - exp_1
 
         p1_elo = p1.elo
         p2_elo = p2.elo
 
-        p1.update_elo(exp_1, self.is_winner(p1))
-        p2.update_elo(exp_2, self.is_winner(p2))
-
-        pt1, pt2 = self.participations.all()
-
-        pt1.delta = p1.elo - p1_elo
-        pt2.delta = p2.elo - p2_elo
-
-        pt1.save()
-        pt2.save()
+        winner, _ = self.get_result(pt1, pt2)
+        p1.update_elo(exp_1, winner is pt1)
+        p2.update_elo(exp_2, winner is pt2)
+
+        pt1.delta = int(p1.elo - p1_elo)
+        pt2.delta = int(p2.elo - p2_elo)
+
+    def update_statistics(self, pt1, pt2):
+        winner, _ = self.get_result(pt1, pt2)
+        results = {
+            pt.player_id: (pt is winner, pt.score, other.score)
+            for pt, other in ((pt1, pt2), (pt2, pt1))
+        }
+        PlayerStats.objects.record(results, self.date)
+        HeadToHead.objects.record(pt1.player_id, pt2.player_id, results)
+
+    def enqueue_recording(self, pt1, pt2):
+        """Have the `record_match` job store the statistics and the players' new ratings"""
+        Job.objects.enqueue('record_match', match=self.pk, ratings={pt.player_id: pt.player.elo for pt in (pt1, pt2)})
+
+    def enqueue_rerating(self, players=(), since=None):
+        """
+        Have the ratings from this match on corrected after it was changed or deleted.
+
+        `players` and `since` are the players and the date the match had before the
+        change, the old and the current ones are re-rated by the `rerate` job.
+        """
+        participations = list(MatchParticipation.objects.filter(match_id=self.pk).order_by('id'))
+        if len(participations) == 2:
+            self.set_result(*participations)
+        else:
+            # an incomplete match has no result, it is not rated or counted until it is complete again
+            self.winner_id = self.loser_id = self.num_legs = None
+        Match.objects.filter(pk=self.pk).update(
+            winner_id=self.winner_id, loser_id=self.loser_id, num_legs=self.num_legs)
+        players = set(players) | {pt.player_id for pt in participations}
+        date = min(self.date, since) if since else self.date
+        Job.objects.enqueue('rerate', players=sorted(players), date=date.isoformat(), match=self.pk)
+
+    def store_ratings(self, ratings):
+        """
+        Snapshot the ratings, a dict of player id to Elo right after this match.
+
+        A recomputation between the report and its record_match job has stored
+        the snapshots already, those are kept.
+        """
+        RatingSnapshot.objects.bulk_create([
+            RatingSnapshot(match=self, player_id=player_id, date=self.date, elo=elo)
+            for player_id, elo in ratings.items()
+        ], ignore_conflicts=True)
+
+    def set_result(self, pt1, pt2):
+        winner, loser = self.get_result(pt1, pt2)
+        self.winner_id = winner.player_id
+        self.loser_id = loser.player_id
+        self.num_legs = pt1.score + pt2.score
 
+    @staticmethod
+    def get_result(pt1, pt2):
+        """
+        Return the (winning, losing) participations.
 
-    @property
-    def winner(self):
-        # if the participations have been prefetched, this doesnt hit the db again
-        return sorted(self.participations.all(), key=lambda pt: pt.score, reverse=True)[0].player
+        Ties are won by the participation that was created first, so `pt1` must
+        be the older one.
+        """
+        if pt2.score > pt1.score:
+            return pt2, pt1
+        return pt1, pt2
 
     @property
     def players(self):
         return [pt.player for pt in self.participations.all()]
 
     def is_winner(self, player):
-        return self.winner == player
+        return self.winner_id == player.pk
 
     def get_score_for_player(self, player):
         for pt in self.participations.all():
@@ -234,11 +435,330 @@ class Match(models.Model):
 
 
 class MatchParticipation(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['player', 'match'], name='ranking_part_player_match_idx'),
+        ]
     match = models.ForeignKey(Match, models.CASCADE, related_name='participations')
     player = models.ForeignKey(Player, models.CASCADE)
     score = models.IntegerField(validators=[MinValueValidator(0)])
-    delta = models.IntegerField()
+    # set by the rating, 0 until then (e.g. for participations added in the admin)
+    delta = models.IntegerField(default=0)
+
+    objects = MatchParticipationQuerySet.as_manager()
 
     def __str__(self):
         return '{} {}'.format(self.player, self.score)
 
+
+def bulk_batch_size(model, limit=1000):
+    """Batch size for bulk_create(), at most `limit` but small enough for the backend's parameter limit"""
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    ops = connections[router.db_for_write(model)].ops
+    return max(min(limit, ops.bulk_batch_size(fields, range(limit))), 1)
+
+
+def _per_key(field, values):
+    """CASE expression picking a value per row from a {key: value} mapping"""
+    return Case(*[When(**{field: key}, then=Value(value)) for key, value in values.items()],
+                output_field=models.PositiveIntegerField())
+
+
+class PlayerStatsManager(models.Manager):
+    def record(self, results, date):
+        """
+        Add the results of a match to the players' totals with a single UPDATE.
+
+        `results` maps player ids to (won, legs won, legs lost) tuples.
+        """
+        updated = self.filter(player__in=results).update(
+            matches_won=F('matches_won') + _per_key('player', {pk: int(r[0]) for pk, r in results.items()}),
+            matches_lost=F('matches_lost') + _per_key('player', {pk: int(not r[0]) for pk, r in results.items()}),
+            legs_won=F('legs_won') + _per_key('player', {pk: r[1] for pk, r in results.items()}),
+            legs_lost=F('legs_lost') + _per_key('player', {pk: r[2] for pk, r in results.items()}),
+            last_match=Greatest('last_match', Value(date)),
+        )
+        if updated < len(results):
+            existing = set(self.filter(player__in=results).values_list('player', flat=True))
+            for pk, (won, legs_won, legs_lost) in results.items():
+                if pk not in existing:
+                    self.create(player_id=pk, matches_won=int(won), matches_lost=int(not won),
+                                legs_won=legs_won, legs_lost=legs_lost, last_match=date)
+
+    def rebuild(self, head_to_heads, players=None):
+        """
+        Recreate the totals of `players` (all players by default) from their head-to-heads.
+
+        `head_to_heads` are all pairs of these players; returns the number of new rows.
+        """
+        last_matches = MatchParticipation.objects.values('player').annotate(
+            last_match=Max('match__date')).order_by()
+        stored = self.all()
+        if players is not None:
+            last_matches = last_matches.filter(player__in=players)
+            stored = stored.filter(player__in=players)
+        totals = {row['player']: PlayerStats(player_id=row['player'], last_match=row['last_match'])
+                  for row in last_matches}
+        for h2h in head_to_heads:
+            stats = totals[h2h.player_id]
+            stats.matches_won += h2h.wins
+            stats.matches_lost += h2h.losses
+            stats.legs_won += h2h.legs_won
+            stats.legs_lost += h2h.legs_lost
+        with transaction.atomic():
+            stored.delete()
+            self.bulk_create(totals.values())
+        return len(totals)
+
+
+class PlayerStats(models.Model):
+    """Denormalized per-player totals, kept up to date by Match.update_statistics (see the record_match job)"""
+    class Meta:
+        verbose_name_plural = 'player stats'
+    player = models.OneToOneField(Player, models.CASCADE, primary_key=True, related_name='stats')
+    matches_won = models.PositiveIntegerField(default=0)
+    matches_lost = models.PositiveIntegerField(default=0)
+    legs_won = models.PositiveIntegerField(default=0)
+    legs_lost = models.PositiveIntegerField(default=0)
+    last_match = models.DateTimeField(null=True, blank=True)
+
+    objects = PlayerStatsManager()
+
+    def __str__(self):
+        return 'Stats for {}'.format(self.player_id)
+
+
+class HeadToHeadManager(models.Manager):
+    def record(self, player, opponent, results):
+        """
+        Add the result of a match to both directions of a pair with a single UPDATE.
+
+        `results` maps both player ids to (won, legs won, legs lost) tuples.
+        """
+        updated = self.filter(Q(player=player, opponent=opponent) | Q(player=opponent, opponent=player)).update(
+            wins=F('wins') + _per_key('player', {pk: int(r[0]) for pk, r in results.items()}),
+            losses=F('losses') + _per_key('player', {pk: int(not r[0]) for pk, r in results.items()}),
+            legs_won=F('legs_won') + _per_key('player', {pk: r[1] for pk, r in results.items()}),
+            legs_lost=F('legs_lost') + _per_key('player', {pk: r[2] for pk, r in results.items()}),
+        )
+        if updated < 2:
+            existing = set(self.filter(player__in=results, opponent__in=results).values_list('player', flat=True))
+            for pk, other in ((player, opponent), (opponent, player)):
+                if pk not in existing:
+                    won, legs_won, legs_lost = results[pk]
+                    self.create(player_id=pk, opponent_id=other, wins=int(won), losses=int(not won),
+                                legs_won=legs_won, legs_lost=legs_lost)
+
+    def matrix(self):
+        """Map (player id, opponent id) to (wins, losses, legs won, legs lost) for all pairs"""
+        rows = self.values_list('player', 'opponent', 'wins', 'losses', 'legs_won', 'legs_lost')
+        return {(row[0], row[1]): row[2:] for row in rows}
+
+    def rebuild(self, players=None):
+        """
+        Recreate the pairs among `players` (all pairs by default) from the match history.
+
+        A changed match only changes the pairs of its old and new players, so
+        only these need to be rebuilt. Returns the new rows.
+        """
+        participations = MatchParticipation.objects.all()
+        stored = self.all()
+        if players is not None:
+            participations = participations.filter(player__in=players)
+            stored = stored.filter(player__in=players, opponent__in=players)
+        records = []
+        for row in participations.head_to_head(opponents=players):
+            record = HeadToHead(
+                player_id=row['player'],
+                opponent_id=row['match__participations__player'],
+                wins=row['wins'],
+                losses=row['matches'] - row['wins'],
+                legs_won=row['legs_won'],
+                legs_lost=row['legs_lost'],
+            )
+            records.append(record)
+        with transaction.atomic():
+            stored.delete()
+            self.bulk_create(records, batch_size=bulk_batch_size(HeadToHead))
+        return records
+
+
+class HeadToHead(models.Model):
+    """Denormalized results of a player against one opponent, stored for both directions"""
+    class Meta:
+        unique_together = ('player', 'opponent')
+    player = models.ForeignKey(Player, models.CASCADE, related_name='head_to_heads')
+    opponent = models.ForeignKey(Player, models.CASCADE, related_name='+')
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    legs_won = models.PositiveIntegerField(default=0)
+    legs_lost = models.PositiveIntegerField(default=0)
+
+    objects = HeadToHeadManager()
+
+    def __str__(self):
+        return '{} vs {}: {}-{}'.format(self.player_id, self.opponent_id, self.wins, self.losses)
+
+    @property
+    def winrate(self):
+        try:
+            return (float(self.wins) / (self.wins + self.losses)) * 100
+        except ZeroDivisionError:
+            return 0
+
+
+class RatingSnapshot(models.Model):
+    """A player's Elo right after a match"""
+    class Meta:
+        unique_together = ('match', 'player')
+        indexes = [
+            models.Index(fields=['player', 'date'], name='ranking_rating_player_date_idx'),
+        ]
+    match = models.ForeignKey(Match, models.CASCADE, related_name='ratings')
+    player = models.ForeignKey(Player, models.CASCADE, related_name='rating_history')
+    # copied from the match, so the history of a player can be read from the index alone
+    date = models.DateTimeField()
+    elo = models.FloatField()
+
+    def __str__(self):
+        return '{} {} after match {}'.format(self.player_id, round(self.elo), self.match_id)
+
+
+class Season(models.Model):
+    """
+    A stretch of time the standings are shown for.
+
+    Ratings carry over from season to season, the standings of a season are the
+    Elo of its players at its end. Once a season is closed they are frozen into
+    SeasonStanding rows.
+    """
+    class Meta:
+        ordering = ['-start']
+    name = models.CharField(max_length=50)
+    slug = models.SlugField(unique=True)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    closed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.start and self.end and self.end <= self.start:
+            raise ValidationError({'end': 'Die Saison muss nach ihrem Beginn enden'})
+
+    def get_standings(self):
+        """The players of the season as Players annotated with `rank`, `rating` and `season_matches`"""
+        if self.closed:
+            return Player.objects.filter(season_standings__season=self).annotate(
+                rank=F('season_standings__rank'),
+                rating=F('season_standings__elo'),
+                season_matches=F('season_standings__num_matches'),
+            ).order_by('rank', 'name')
+        return self.compute_standings()
+
+    def compute_standings(self):
+        """The standings from the rating snapshots, in one query; only the players who played in the season"""
+        played = MatchParticipation.objects.filter(
+            player=OuterRef('pk'), match__date__gte=self.start, match__date__lte=self.end,
+        ).order_by().values('player').annotate(count=Count('id')).values('count')
+        return Player.objects.as_of(self.end, since=self.start).annotate(
+            season_matches=Subquery(played, output_field=models.IntegerField()))
+
+    def close(self):
+        """Freeze the standings; closing a closed season again freezes them anew. Returns their number."""
+        with transaction.atomic():
+            standings = [
+                SeasonStanding(season=self, player_id=p.pk, rank=p.rank, elo=p.rating, num_matches=p.season_matches)
+                for p in self.compute_standings()
+            ]
+            self.standings.all().delete()
+            SeasonStanding.objects.bulk_create(standings)
+            self.closed = True
+            self.save(update_fields=['closed'])
+        return len(standings)
+
+
+class SeasonStanding(models.Model):
+    """A player's place in a closed season"""
+    class Meta:
+        unique_together = ('season', 'player')
+    season = models.ForeignKey(Season, models.CASCADE, related_name='standings')
+    player = models.ForeignKey(Player, models.CASCADE, related_name='season_standings')
+    rank = models.PositiveIntegerField()
+    elo = models.FloatField()
+    num_matches = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{}. {} in {}'.format(self.rank, self.player_id, self.season_id)
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, name, **arguments):
+        """
+        Add a job for `manage.py run_jobs`, see ranking.jobs.
+
+        Call it inside the transaction of the change the job belongs to, then the
+        job exists exactly if the change was committed.
+        """
+        return self.create(name=name, arguments=json.dumps(arguments))
+
+    def enqueue_once(self, name, **arguments):
+        """Like enqueue, unless the same job is still waiting to be run"""
+        if not self.filter(name=name, arguments=json.dumps(arguments), status=Job.PENDING).exists():
+            return self.enqueue(name, **arguments)
+
+    def unfinished(self, name):
+        """The jobs of `name` that are still waiting or running; failed ones are left to an admin"""
+        return self.filter(name=name).exclude(status=Job.FAILED)
+
+    def claim(self, limit, timeout):
+        """
+        Mark up to `limit` due jobs as running and return them.
+
+        Rows locked by other workers are skipped instead of waited for. Jobs that
+        have been running for more than `timeout` seconds are claimed again, their
+        worker has most likely died.
+        """
+        now = timezone.now()
+        due = Q(status=Job.PENDING, run_after__lte=now) | Q(status=Job.RUNNING, started__lt=now - timedelta(seconds=timeout))
+        with transaction.atomic():
+            jobs = list(self.select_for_update(skip_locked=True).filter(due).order_by('run_after', 'id')[:limit])
+            if jobs:
+                self.filter(pk__in=[job.pk for job in jobs]).update(
+                    status=Job.RUNNING, started=now, attempts=F('attempts') + 1)
+        for job in jobs:
+            job.status, job.started, job.attempts = Job.RUNNING, now, job.attempts + 1
+        return jobs
+
+
+class Job(models.Model):
+    """Work left to do after a request; finished jobs are deleted, failed ones are kept for inspection"""
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='ranking_job_status_run_idx'),
+        ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Wartend'),
+        (RUNNING, 'Läuft'),
+        (FAILED, 'Fehlgeschlagen'),
+    )
+    name = models.CharField(max_length=100)
+    # keyword arguments of the job function, as JSON
+    arguments = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} #{} ({})'.format(self.name, self.pk, self.status)
+
+    def get_arguments(self):
+        return json.loads(self.arguments)
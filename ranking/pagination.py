@@ -0,0 +1,58 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(match):
+    value = '{}|{}'.format(match.date.isoformat(), match.pk)
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        date, pk = parse_datetime(date), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        date = None
+    if date is None:
+        raise Http404('Invalid cursor')
+    return date, pk
+
+
+class MatchPage(object):
+    """One page of matches, newest first, with the cursor to the next page"""
+
+    def __init__(self, matches, next_cursor):
+        self.matches = matches
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.matches)
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __bool__(self):
+        return bool(self.matches)
+
+
+def paginate_matches(queryset, cursor=None, per_page=25):
+    """
+    Keyset pagination over (date, id), newest first.
+
+    Every page is a range scan on the match date index after the last match of
+    the previous page, so deep pages are as cheap as the first one.
+    """
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    matches = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(matches) > per_page:
+        matches = matches[:per_page]
+        next_cursor = encode_cursor(matches[-1])
+    return MatchPage(matches, next_cursor)
@@ -0,0 +1,75 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_SESSION_KEY = 'primary_until'
+
+_state = threading.local()
+
+
+def read_replica(view_func):
+    """Let a function based view read the ranking data from a replica; see ReplicaRouter"""
+    view_func.read_replica = True
+    return view_func
+
+
+def uses_replica(view_func):
+    if getattr(view_func, 'read_replica', False):
+        return True
+    # class based views declare it as class attribute
+    return getattr(getattr(view_func, 'view_class', None), 'read_replica', False)
+
+
+def get_replica():
+    """The replica alias reads of the current request go to, or None for the primary"""
+    return getattr(_state, 'replica', None)
+
+
+def set_replica(alias):
+    _state.replica = alias
+
+
+def pin_to_primary(session):
+    """
+    Read the session's own writes: its requests skip the replicas for a while.
+
+    Replicas lag behind the primary, so a player who just reported a result
+    could otherwise see the ranking from before the report.
+    """
+    session[PIN_SESSION_KEY] = time.time() + getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+def is_pinned(session):
+    return session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def choose_replica(request):
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    if not replicas or is_pinned(request.session):
+        return None
+    return random.choice(replicas)
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads of the ranking data to the replica chosen for the current request.
+
+    Only requests to views declared with `read_replica` get a replica (see
+    ReplicaMiddleware). All writes, reads of other apps (e.g. sessions) and
+    everything outside of such requests use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'ranking':
+            return get_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
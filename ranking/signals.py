@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent once the transaction that changed any Player.elo has been committed.
+# `players` holds the ids of the rated players, or is None if all ratings may have changed.
+ratings_changed = Signal(providing_args=['players'])
+
+# Sent once a transaction that changed the statistics of the `players` has been committed.
+statistics_changed = Signal(providing_args=['players'])
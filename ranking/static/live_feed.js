@@ -0,0 +1,42 @@
+$(function () {
+    var matches = $('#latest-matches');
+    if (!matches.length || !window.EventSource) {
+        return;
+    }
+    var ranking = $('#ranking');
+
+    function rankingRow(p) {
+        var row = $('<tr>').attr('data-href', ranking.data('profile-url').replace('__slug__', p.slug));
+        if (p.slug === ranking.data('player')) {
+            row.addClass('table-primary');
+        }
+        return row.append(
+            $('<th scope="row">').text(p.rank),
+            $('<td>').text(p.name),
+            $('<td>').text(p.rating)
+        );
+    }
+
+    function updateRanking(data) {
+        if (data.rating === ranking.data('rating')) {
+            // the ranking of another engine follows with the next page load
+            ranking.find('tbody').empty().append($.map(data.ranking, rankingRow));
+        }
+    }
+
+    var source = new EventSource(matches.data('url'));
+    source.addEventListener('match', function (event) {
+        var data = JSON.parse(event.data);
+        matches.find('.empty').remove();
+        matches.prepend(data.match);
+        matches.children('p').slice(matches.data('size')).remove();
+        updateRanking(data);
+    });
+    source.addEventListener('ranking', function (event) {
+        updateRanking(JSON.parse(event.data));
+    });
+    source.addEventListener('reload', function () {
+        source.close();
+        document.location.reload();
+    });
+});
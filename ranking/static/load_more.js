@@ -0,0 +1,12 @@
+$(function () {
+    $(document).on('click', 'a.load-more', function (event) {
+        event.preventDefault();
+        var button = $(this);
+        button.addClass('disabled');
+        $.get(button.attr('href'), function (html) {
+            button.replaceWith(html);
+        }).fail(function () {
+            button.removeClass('disabled');
+        });
+    });
+});
@@ -0,0 +1,28 @@
+$(function () {
+    var chart = $('#rating-chart');
+    if (!chart.length) {
+        return;
+    }
+    var width = 600, height = 200, padding = 20;
+    $.getJSON(chart.data('url'), function (data) {
+        var points = data.points;
+        if (points.length < 2) {
+            chart.text('Noch kein Verlauf...');
+            return;
+        }
+        var times = points.map(function (p) { return Date.parse(p[0]); });
+        var elos = points.map(function (p) { return p[1]; });
+        var minTime = Math.min.apply(null, times), maxTime = Math.max.apply(null, times);
+        var minElo = Math.min.apply(null, elos), maxElo = Math.max.apply(null, elos);
+        var x = function (t) { return padding + (width - 2 * padding) * (t - minTime) / ((maxTime - minTime) || 1); };
+        var y = function (e) { return height - padding - (height - 2 * padding) * (e - minElo) / ((maxElo - minElo) || 1); };
+        var coords = points.map(function (p, i) { return x(times[i]).toFixed(1) + ',' + y(elos[i]).toFixed(1); });
+        chart.html(
+            '<svg viewBox="0 0 ' + width + ' ' + height + '" width="100%">' +
+            '<text x="0" y="12" font-size="12">' + Math.round(maxElo) + '</text>' +
+            '<text x="0" y="' + (height - 2) + '" font-size="12">' + Math.round(minElo) + '</text>' +
+            '<polyline fill="none" stroke="#007bff" stroke-width="2" points="' + coords.join(' ') + '"/>' +
+            '</svg>'
+        );
+    });
+});
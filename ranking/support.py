@@ -1,19 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from ranking.metrics import record_cache
 from ranking.models import Player
 
 import logging
 logger = logging.getLogger(__name__)
 
+CACHE_KEY = 'session-player:{}'
+
+
+def _cache_key(session):
+    return CACHE_KEY.format(session.session_key)
+
+
 def get_session_player(session):
     try:
         key = session['profile']
     except KeyError:
         return None
+
+    timeout = getattr(settings, 'SESSION_PLAYER_CACHE_TIMEOUT', 0)
+    if timeout and session.session_key:
+        player = cache.get(_cache_key(session))
+        hit = player is not None and player.pk == key
+        record_cache('session_player', hit)
+        if hit:
+            return player
+
     try:
-        return Player.objects.get(pk=key)
+        player = Player.objects.get(pk=key)
     except Player.DoesNotExist:
         logger.warning('SESSION: no matching player for key=%s', key)
         return None
 
+    if timeout and session.session_key:
+        cache.set(_cache_key(session), player, timeout)
+    return player
+
+
+def get_request_player(request):
+    """
+    The player of the request's session, looked up at most once per request.
+
+    Evaluates to a falsy object if nobody is logged in.
+    """
+    if not hasattr(request, 'player'):
+        request.player = SimpleLazyObject(lambda: get_session_player(request.session))
+    return request.player
+
 
 def set_session_player(session, player):
     if not player.pk:
@@ -21,10 +57,14 @@ def set_session_player(session, player):
         logger.warning(msg, player.name)
         return
     session['profile'] = player.pk
+    if session.session_key:
+        cache.delete(_cache_key(session))
 
 
 def clear_session_player(session):
+    if session.session_key:
+        cache.delete(_cache_key(session))
     try:
         del session['profile']
     except KeyError:
-        pass
\ No newline at end of file
+        pass
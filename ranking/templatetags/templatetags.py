@@ -2,6 +2,9 @@ import re
 
 from django import template
 from django.urls import reverse, NoReverseMatch
+from django.utils.safestring import mark_safe
+
+from ranking import fragments
 
 register = template.Library()
 
@@ -23,3 +26,8 @@ def sign(value):
     if value > 0:
         return '<span class="text-success">+{}</span>'.format(value)
     return '<span class="text-danger">{}</span>'.format(value)
+
+
+@register.simple_tag
+def render_matches(matches):
+    return mark_safe(fragments.render_matches(matches))
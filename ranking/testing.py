@@ -0,0 +1,32 @@
+from contextlib import ContextDecorator
+
+from ranking.instrumentation import QueryRecorder
+
+
+class max_queries(ContextDecorator):
+    """
+    Fail a test if the wrapped code runs more than `limit` queries.
+
+    Usable as decorator or context manager, e.g. around a test client request:
+
+        with max_queries(5):
+            self.client.get(reverse('home'))
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def __enter__(self):
+        self.recorder = QueryRecorder()
+        self.stack = self.recorder.record()
+        self.stack.__enter__()
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        self.stack.__exit__(*exc_info)
+        if exc_info[0] is None and self.recorder.count > self.limit:
+            statements = '\n'.join(
+                '{}x {}'.format(count, sql) for sql, count in self.recorder.statements.most_common())
+            raise AssertionError('{} queries executed, the budget is {}:\n{}'.format(
+                self.recorder.count, self.limit, statements))
+        return False
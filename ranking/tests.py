@@ -1,3 +1,863 @@
-from django.test import TestCase
+import csv
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ranking import elo, engines, glicko, jobs, leaderboard, live, matchmaking, metrics, routers, views
+from ranking.models import (
+    HeadToHead, Job, Match, MatchParticipation, Player, PlayerStats, RatingSnapshot, Season, SeasonStanding,
+)
+from ranking.pagination import paginate_matches
+from ranking.testing import max_queries
+
+
+def make_players(num):
+    players = []
+    for i in range(num):
+        player = Player(name='Spieler{}'.format(i))
+        player.set_password('geheim')
+        player.save()
+        players.append(player)
+    return players
+
+
+def make_match(player, player_score, opponent, opponent_score, date=None):
+    """A match as the admin or an import stores it, without rating it"""
+    match = Match.objects.create(date=date or timezone.now())
+    pt1 = MatchParticipation.objects.create(match=match, player=player, score=player_score)
+    pt2 = MatchParticipation.objects.create(match=match, player=opponent, score=opponent_score)
+    match.set_result(pt1, pt2)
+    Match.objects.filter(pk=match.pk).update(winner_id=match.winner_id, loser_id=match.loser_id,
+                                             num_legs=match.num_legs)
+    return match
+
+
+def get_statistics():
+    return HeadToHead.objects.matrix(), list(PlayerStats.objects.order_by('player').values())
+
+
+def get_ratings():
+    """Everything the Elo replay writes"""
+    return (
+        dict(Player.objects.values_list('id', 'elo')),
+        dict(MatchParticipation.objects.values_list('id', 'delta')),
+        sorted(RatingSnapshot.objects.values_list('match', 'player', 'date', 'elo')),
+    )
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'geheim')
+        self.client.login(username='admin', password='geheim')
+        self.players = make_players(2)
+
+    def test_add_match(self):
+        date = timezone.localtime() - timedelta(days=1)
+        response = self.client.post('/admin/ranking/match/add/', {
+            'date_0': date.strftime('%Y-%m-%d'), 'date_1': date.strftime('%H:%M:%S'),
+            'participations-TOTAL_FORMS': 2, 'participations-INITIAL_FORMS': 0,
+            'participations-MIN_NUM_FORMS': 0, 'participations-MAX_NUM_FORMS': 2,
+            'participations-0-player': self.players[0].pk, 'participations-0-score': 3,
+            'participations-1-player': self.players[1].pk, 'participations-1-score': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        match = Match.objects.get()
+        self.assertEqual((match.winner_id, match.loser_id, match.num_legs), (self.players[0].pk, self.players[1].pk, 4))
+        job = Job.objects.get(name='rerate')
+        self.assertEqual(job.get_arguments()['players'], sorted(p.pk for p in self.players))
+
+    def test_change_match(self):
+        date = timezone.now() - timedelta(days=2)
+        match = make_match(self.players[0], 3, self.players[1], 1, date=date)
+        other = Player.objects.create(name='Spieler2')
+        pt1, pt2 = match.participations.order_by('id')
+        new_date = timezone.localtime() - timedelta(days=1)
+        response = self.client.post('/admin/ranking/match/{}/change/'.format(match.pk), {
+            'date_0': new_date.strftime('%Y-%m-%d'), 'date_1': new_date.strftime('%H:%M:%S'),
+            'participations-TOTAL_FORMS': 2, 'participations-INITIAL_FORMS': 2,
+            'participations-MIN_NUM_FORMS': 0, 'participations-MAX_NUM_FORMS': 2,
+            'participations-0-id': pt1.pk, 'participations-0-match': match.pk,
+            'participations-0-player': self.players[0].pk, 'participations-0-score': 3,
+            'participations-1-id': pt2.pk, 'participations-1-match': match.pk,
+            'participations-1-player': other.pk, 'participations-1-score': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        arguments = Job.objects.get(name='rerate').get_arguments()
+        # the old and the new players, from the earlier of both dates
+        self.assertEqual(arguments['players'], sorted([self.players[0].pk, self.players[1].pk, other.pk]))
+        self.assertEqual(arguments['date'], date.isoformat())
+
+    def test_add_participation(self):
+        match = Match.objects.create(date=timezone.now())
+        response = self.client.post('/admin/ranking/matchparticipation/add/', {
+            'match': match.pk, 'player': self.players[0].pk, 'score': 3,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(MatchParticipation.objects.get().delta, 0)
+        self.assertTrue(Job.objects.filter(name='rerate').exists())
+
+
+class PlayerSearchTest(TestCase):
+    def test_pages(self):
+        make_players(views.PLAYER_SEARCH_LIMIT + 5)
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        first = self.client.get('/players/search.json', {'term': 'spieler'}).json()
+        second = self.client.get('/players/search.json', {'term': 'spieler', 'page': 2}).json()
+        self.assertEqual((len(first['results']), first['more']), (views.PLAYER_SEARCH_LIMIT, True))
+        self.assertEqual((len(second['results']), second['more']), (4, False))
+        names = [p['text'] for p in first['results'] + second['results']]
+        self.assertEqual(sorted(names), sorted(p.name for p in Player.objects.exclude(name='Spieler0')))
+        self.assertEqual(self.client.get('/players/search.json', {'term': 'spieler', 'page': 0}).status_code, 400)
+
+
+class RatingHistoryTest(TestCase):
+    def test_points(self):
+        players = make_players(2)
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        now = timezone.now()
+        for i in range(5):
+            make_match(players[0], 3, players[1], i % 3, date=now - timedelta(days=5 - i))
+        elo.recompute()
+        path = '/profile/{}/rating.json'.format(players[0].slug)
+        self.assertEqual(len(self.client.get(path, {'points': 2}).json()['points']), 2)
+        for points in (1, 0, -3):
+            self.assertEqual(self.client.get(path, {'points': points}).status_code, 400)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.players = make_players(3)
+        self.first = make_match(self.players[0], 3, self.players[1], 1,
+                                date=datetime(2020, 1, 10, 12, tzinfo=timezone.utc))
+        self.second = make_match(self.players[1], 2, self.players[2], 3,
+                                 date=datetime(2020, 2, 10, 12, tzinfo=timezone.utc))
+        incomplete = Match.objects.create(date=datetime(2020, 3, 1, 12, tzinfo=timezone.utc))
+        MatchParticipation.objects.create(match=incomplete, player=self.players[0], score=3)
+        elo.recompute()
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+
+    def get_body(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_matches_csv(self):
+        rows = list(csv.reader(self.get_body('/export/matches.csv').splitlines()))
+        self.assertEqual(rows[0], ['id', 'date', 'winner', 'winner_score', 'winner_delta', 'loser', 'loser_score',
+                                   'loser_delta'])
+        expected = []
+        for match, winner, loser in ((self.first, 0, 1), (self.second, 2, 1)):
+            pts = {pt.player_id: pt for pt in match.participations.all()}
+            winner, loser = pts[self.players[winner].pk], pts[self.players[loser].pk]
+            expected.append([str(match.pk), str(match.date), winner.player.slug, str(winner.score),
+                             str(winner.delta), loser.player.slug, str(loser.score), str(loser.delta)])
+        # the incomplete match is left out
+        self.assertEqual(rows[1:], expected)
+
+    def test_ndjson_filters(self):
+        def get_rows(kind, **params):
+            body = self.get_body('/export/{}.ndjson'.format(kind), **params)
+            return [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual([row['id'] for row in get_rows('matches', end='2020-02-01')], [self.first.pk])
+        participation = self.second.participations.get(player=self.players[1])
+        self.assertEqual(get_rows('participations', start='2020-02-01', player='spieler1'), [{
+            'id': participation.pk, 'match': self.second.pk, 'date': '2020-02-10T12:00:00Z',
+            'player': 'spieler1', 'score': 2, 'delta': participation.delta,
+        }])
+        self.assertEqual(get_rows('players', player='spieler2'), [
+            {'id': self.players[2].pk, 'name': 'Spieler2', 'slug': 'spieler2',
+             'elo': Player.objects.get(pk=self.players[2].pk).elo},
+        ])
+        self.assertEqual(self.client.get('/export/matches.ndjson', {'start': 'gestern'}).status_code, 400)
+
+
+class LiveTest(TestCase):
+    @override_settings(LIVE_MAX_STREAMS=1)
+    def test_max_streams(self):
+        hub = live.Hub()
+        first = live.stream(hub=hub)
+        self.assertEqual(next(first), 'retry: 5000\n\n')
+        self.assertEqual(list(live.stream(hub=hub)), ['retry: {}\n\n'.format(live.BUSY_RETRY)])
+        first.close()
+        self.assertEqual(next(live.stream(hub=hub)), 'retry: 5000\n\n')
+
+
+@override_settings(LIVE_POLL_INTERVAL=3600, LIVE_LOOKBACK=10)
+class HubTest(TestCase):
+    """The hub's thread sleeps, refresh() is called by the tests instead"""
+
+    def setUp(self):
+        cache.clear()
+        self.players = make_players(2)
+        self.first = make_match(self.players[0], 3, self.players[1], 1)
+        self.hub = live.Hub(size=4)
+        self.hub.start()
+
+    def add_match(self, pk):
+        match = Match.objects.create(pk=pk, date=timezone.now())
+        MatchParticipation.objects.create(match=match, player=self.players[0], score=3)
+        MatchParticipation.objects.create(match=match, player=self.players[1], score=1)
+        return match
+
+    def get_events(self, seq=0):
+        return [(event.name, event.match) for event in self.hub.since(seq)]
+
+    def test_late_match(self):
+        pk = self.first.pk
+        # the report of the match with the lower id commits last
+        self.add_match(pk + 2)
+        self.hub.refresh()
+        self.add_match(pk + 1)
+        self.hub.refresh()
+        self.hub.refresh()
+        self.assertEqual(self.get_events(), [('match', pk + 2), ('match', pk + 1)])
+        # too late to be looked for anymore
+        self.add_match(pk + 20)
+        self.hub.refresh()
+        self.add_match(pk + 3)
+        self.hub.refresh()
+        self.assertEqual(self.get_events(2), [('match', pk + 20)])
+
+    def test_ranking(self):
+        self.hub.refresh()
+        self.assertEqual(self.get_events(), [])
+        # a correction or recomputation, without a new match
+        cache.delete(leaderboard.VERSION_KEY)
+        self.hub.refresh()
+        self.hub.refresh()
+        event, = self.hub.since(0)
+        self.assertEqual(event.name, 'ranking')
+        self.assertEqual([p['name'] for p in json.loads(event.data)['ranking']], ['Spieler0', 'Spieler1'])
+
+    def test_resume(self):
+        pk = self.first.pk
+        for i in (2, 1, 3):
+            self.add_match(pk + i)
+            self.hub.refresh()
+        events = self.hub.since(0)
+        # the same process continues after the event
+        self.assertEqual(self.hub.resume(events[0].id), (1, []))
+        # another process sends the matches with higher ids, including late ones
+        seq, backlog = self.hub.resume('abcdef12-7-{}'.format(pk + 1))
+        self.assertEqual((seq, [event.match for event in backlog]), (3, [pk + 2, pk + 3]))
+        self.assertEqual(self.hub.resume(None), (3, []))
+        for i in range(4, 7):
+            self.add_match(pk + i)
+            self.hub.refresh()
+        # no longer buffered
+        self.assertIsNone(self.hub.resume(events[0].id))
+        self.assertIsNone(self.hub.resume('abcdef12-7-{}'.format(pk)))
+
+    def test_stream(self):
+        self.add_match(self.first.pk + 1)
+        self.hub.refresh()
+        event = self.hub.since(0)[0]
+        lines = live.stream(event.id, hub=self.hub)
+        self.assertEqual(next(lines), 'retry: 5000\n\n')
+        self.add_match(self.first.pk + 2)
+        self.hub.refresh()
+        self.assertTrue(next(lines).startswith('id: {}-2-{}\nevent: match\n'.format(self.hub.token, self.first.pk + 2)))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaTest(TransactionTestCase):
+    # replica1 mirrors the test database, see DATABASES in the settings
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        self.players = make_players(2)
+        make_match(self.players[0], 3, self.players[1], 1)
+
+    def tearDown(self):
+        # the choice is only reset by the next request, the other tests read outside of requests
+        routers.set_replica(None)
+
+    def request(self, method, path, data=None):
+        """The response with the ranking queries sent to the primary and to the replica"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica1']) as replica:
+            response = getattr(self.client, method)(path, data)
+        return response, [[query['sql'] for query in context.captured_queries if 'ranking_' in query['sql']]
+                          for context in (primary, replica)]
+
+    def test_replica_views(self):
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        # the cached leaderboard and match fragments are built from the primary
+        self.client.get('/profile/spieler1/')
+        response, (primary, replica) = self.request('get', '/profile/spieler1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+    def test_other_views(self):
+        response, (primary, replica) = self.request('post', '/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+    def test_pinned_after_report(self):
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        self.assertTrue(self.request('get', '/')[1][1])
+        response, (primary, replica) = self.request('post', '/result/', {
+            'opponent': self.players[1].pk, 'player_score': 3, 'opponent_score': 0})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(any(sql.startswith('INSERT INTO "ranking_match"') for sql in primary))
+        self.assertEqual(replica, [])
+
+        response, (primary, replica) = self.request('get', '/')
+        self.assertContains(response, 'Spieler0')
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+
+class MetricsTest(TestCase):
+    def test_concurrent_flush(self):
+        errors = []
+
+        def report():
+            try:
+                for _ in range(100):
+                    metrics.MATCHES_REPORTED.inc()
+                    metrics.REGISTRY.flush()
+            except Exception as e:
+                errors.append(e)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = metrics.REGISTRY.collect()[metrics.MATCHES_REPORTED.name].get((), 0)
+            threads = [threading.Thread(target=report) for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(metrics.REGISTRY.collect()[metrics.MATCHES_REPORTED.name][()], before + 1600)
+            for name in glob.glob(os.path.join(directory, '*.json')):
+                with open(name) as f:
+                    json.load(f)
+
+    def test_exited_processes(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = metrics.REGISTRY.collect()[metrics.MATCHES_REPORTED.name].get((), 0)
+            for suffix, value in [('aaaaaaaa', 2), ('bbbbbbbb', 3)]:
+                with open(os.path.join(directory, 'metrics-{}-{}.json'.format(exited.pid, suffix)), 'w') as f:
+                    json.dump({metrics.MATCHES_REPORTED.name: [[[], value]]}, f)
+            for _ in range(2):
+                self.assertEqual(metrics.REGISTRY.collect()[metrics.MATCHES_REPORTED.name][()], before + 5)
+                self.assertEqual(glob.glob(os.path.join(directory, 'metrics-{}-*'.format(exited.pid))), [])
+            self.assertTrue(os.path.exists(os.path.join(directory, metrics.EXITED_FILE)))
+
+
+class RecomputeTest(TestCase):
+    def test_recording_after_recompute(self):
+        players = make_players(2)
+        match = Match.objects.report(players[0], players[1], 3, 1)
+        elo.recompute()
+        job, = Job.objects.claim(1, 60)
+        self.assertTrue(jobs.run(job))
+        self.assertEqual(match.ratings.count(), 2)
+
+    def test_incomplete_match(self):
+        players = make_players(3)
+        now = timezone.now()
+        incomplete = make_match(players[0], 3, players[1], 1, date=now - timedelta(days=2))
+        make_match(players[1], 3, players[2], 1, date=now - timedelta(days=1))
+        elo.recompute()
+        MatchParticipation.objects.filter(match=incomplete, player=players[0]).delete()
+        self.assertEqual(elo.recompute()[:2], (1, 1))
+        self.assertEqual(MatchParticipation.objects.get(match=incomplete).delta, 0)
+        self.assertFalse(incomplete.ratings.exists())
+        self.assertEqual(Player.objects.get(pk=players[1].pk).elo, elo.INITIAL_ELO + elo.K_FACTOR / 2)
+
+    def test_enqueues_batch_engines(self):
+        make_players(2)
+        elo.recompute(dry_run=True)
+        self.assertFalse(Job.objects.exists())
+        elo.recompute()
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['recompute_ratings'])
+
+
+class RerateTest(TestCase):
+    def test_same_as_recompute(self):
+        players = make_players(4)
+        now = timezone.now()
+        matches = [
+            make_match(players[i % 4], 3, players[(i * 3 + 1) % 4], i % 3, date=now - timedelta(days=20 - i))
+            for i in range(12)
+        ]
+        elo.recompute()
+        changed = matches[4]
+        MatchParticipation.objects.filter(match=changed).update(score=0)
+        MatchParticipation.objects.filter(match=changed, player=changed.loser_id).update(score=3)
+        elo.rerate([changed.winner_id, changed.loser_id], changed.date, changed.pk)
+        rerated = get_ratings()
+        elo.recompute()
+        self.assertEqual(rerated, get_ratings())
+
+    def test_incomplete_match(self):
+        alice, bob, carol = make_players(3)
+        now = timezone.now()
+        first = make_match(alice, 3, bob, 1, date=now - timedelta(days=2))
+        second = make_match(bob, 3, carol, 1, date=now - timedelta(days=1))
+        elo.recompute()
+        # the admin deletes a participation of the first match
+        MatchParticipation.objects.filter(match=first, player=alice).delete()
+        first.enqueue_rerating([alice.pk, bob.pk], first.date)
+        for job in Job.objects.claim(10, 60):
+            self.assertTrue(jobs.run(job))
+
+        first.refresh_from_db()
+        self.assertEqual((first.winner_id, first.loser_id, first.num_legs), (None, None, None))
+        self.assertEqual(MatchParticipation.objects.get(match=first).delta, 0)
+        self.assertFalse(first.ratings.exists())
+        # a later correction starts from the ratings before the second match, not from a stale snapshot
+        elo.rerate([bob.pk, carol.pk], second.date, second.pk)
+        elos = dict(Player.objects.values_list('id', 'elo'))
+        self.assertEqual((elos[alice.pk], elos[bob.pk], elos[carol.pk]),
+                         (elo.INITIAL_ELO, elo.INITIAL_ELO + elo.K_FACTOR / 2, elo.INITIAL_ELO - elo.K_FACTOR / 2))
+        self.assertEqual(PlayerStats.objects.get(player=bob).matches_lost, bob.matches_lost.count())
+        rerated = get_ratings()
+        elo.recompute()
+        self.assertEqual(rerated, get_ratings())
+
+
+class EloTest(TestCase):
+    def test_expected_score(self):
+        self.assertAlmostEqual(elo.expected_score(1200, 1000), 1 / (1 + 10 ** -0.5))
+        against = elo.expected_score(1000, [1000, 1400])
+        self.assertEqual([round(q, 6) for q in against], [0.5, round(1 / 11, 6)])
+        self.assertEqual(list(elo.expected_score([1000, 1400], 1000)), [0.5, elo.expected_score(1400, 1000)])
+        self.assertEqual(list(elo.expected_score([1000, 1400], [1400, 1000])),
+                         [elo.expected_score(1000, 1400), elo.expected_score(1400, 1000)])
+        with self.assertRaises(ValueError):
+            elo.expected_score([1000, 1100], [1000])
+
+    def test_win_probabilities(self):
+        elos = [800, 1000, 1234.5, 1500]
+        matrix = elo.win_probabilities(elos)
+        for i, a in enumerate(elos):
+            self.assertAlmostEqual(matrix[i][i], 0.5)
+            for j, b in enumerate(elos):
+                self.assertAlmostEqual(matrix[i][j], elo.expected_score(a, b))
+                self.assertAlmostEqual(matrix[i][j] + matrix[j][i], 1)
+
+
+class MatchmakingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.player, *opponents = make_players(5)
+        # (elo, glicko, glicko deviation, days since the last match)
+        for player, (rating, rating_glicko, deviation, days) in zip(
+                [self.player] + opponents,
+                [(1000, 1500, 50, 1), (1010, 1500, 300, 2), (1200, 1520, 30, 3), (700, 1900, 30, 4),
+                 (1000, 1500, 30, 200)]):
+            Player.objects.filter(pk=player.pk).update(elo=rating, glicko=rating_glicko, glicko_deviation=deviation)
+            PlayerStats.objects.create(player=player, last_match=now - timedelta(days=days))
+        self.player.refresh_from_db()
+
+    def get_suggestions(self, mode):
+        return [(s['name'], s['win_probability']) for s in matchmaking.suggest(self.player, mode)]
+
+    def test_balanced(self):
+        # Spieler4 has not played for too long
+        self.assertEqual(self.get_suggestions(matchmaking.BALANCED), [
+            ('Spieler1', round(elo.expected_score(1000, 1010), 3)),
+            ('Spieler2', round(elo.expected_score(1000, 1200), 3)),
+            ('Spieler3', round(elo.expected_score(1000, 700), 3)),
+        ])
+
+    def test_informative(self):
+        # the certain rating close to the own one tells the most
+        self.assertEqual([name for name, _ in self.get_suggestions(matchmaking.INFORMATIVE)],
+                         ['Spieler2', 'Spieler1', 'Spieler3'])
+
+    def test_inactive_player(self):
+        PlayerStats.objects.filter(player=self.player).update(last_match=timezone.now() - timedelta(days=200))
+        # invalidate() waits for a commit, which never comes in a TestCase
+        cache.delete(matchmaking.VERSION_KEY)
+        self.assertEqual([name for name, _ in self.get_suggestions(matchmaking.BALANCED)],
+                         ['Spieler1', 'Spieler2', 'Spieler3'])
+        players, matrix = matchmaking.get_active_players()
+        self.assertEqual(len(matrix), 3)
+        self.assertNotIn(self.player.pk, [p[0] for p in players])
+
+
+class Glicko2Test(TestCase):
+    def test_example(self):
+        """The example from Glickman's paper"""
+        periods = glicko.Glicko2Periods(3)
+        for player, (rating, deviation) in enumerate([(1500, 200), (1400, 30), (1550, 100), (1700, 300)]):
+            periods.mu[player] = (rating - glicko.INITIAL_RATING) / glicko.SCALE
+            periods.phi[player] = deviation / glicko.SCALE
+        periods.rate_period(0, [(0, 1), (2, 0), (3, 0)])
+        rating, deviation, volatility = periods.get_rating(0, 0)
+        self.assertAlmostEqual(rating, 1464.05, places=2)
+        self.assertAlmostEqual(deviation, 151.52, places=2)
+        self.assertAlmostEqual(volatility, 0.05999, delta=0.00001)
+
+
+class PaginationTest(TestCase):
+    def test_equal_dates(self):
+        players = make_players(2)
+        date = timezone.now()
+        matches = [make_match(players[0], 3, players[1], 1, date=date) for _ in range(5)]
+        older = make_match(players[0], 3, players[1], 1, date=date - timedelta(days=1))
+        ids, cursor = [], None
+        while True:
+            page = paginate_matches(Match.objects.all(), cursor, per_page=2)
+            ids.extend(match.pk for match in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(ids, sorted((match.pk for match in matches), reverse=True) + [older.pk])
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(TestCase):
+    """The views stay within their declared query budgets, even with nothing cached"""
+
+    def setUp(self):
+        cache.clear()
+        self.players = make_players(3)
+        now = timezone.now()
+        for i in range(6):
+            match = make_match(self.players[i % 3], 3, self.players[(i + 1) % 3], i % 3, date=now - timedelta(days=i))
+            match.update_statistics(*match.participations.order_by('id'))
+        elo.recompute()
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+
+    def assertWithinBudget(self, path, budget, status_code=200):
+        with max_queries(budget):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_home(self):
+        self.assertWithinBudget('/', views.HomeView.query_budget)
+        self.assertWithinBudget('/?rating=glicko2', views.HomeView.query_budget)
+
+    def test_matches(self):
+        response = self.assertWithinBudget('/matches/', views.MatchesView.query_budget)
+        self.assertWithinBudget('/matches/?cursor={}'.format(response.context['match_page'].next_cursor or ''),
+                                views.MatchesView.query_budget)
+
+    def test_profile(self):
+        for player in self.players[:2]:
+            self.assertWithinBudget('/profile/{}/'.format(player.name), views.ProfileView.query_budget)
+
+    def test_result(self):
+        self.assertWithinBudget('/result/', views.ReportResultView.query_budget)
+        with max_queries(views.ReportResultView.query_budget):
+            response = self.client.post('/result/', {
+                'opponent': self.players[1].pk, 'player_score': 3, 'opponent_score': 1,
+            })
+        self.assertEqual(response.status_code, 302)
+
+
+class HeadToHeadTest(TestCase):
+    def test_matrix(self):
+        players = make_players(3)
+        now = timezone.now()
+        for i, (a, score_a, b, score_b) in enumerate([(0, 3, 1, 1), (1, 3, 0, 2), (0, 3, 2, 0)]):
+            make_match(players[a], score_a, players[b], score_b, date=now - timedelta(days=3 - i))
+        elo.recompute()
+        PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+        p0, p1, p2 = [player.pk for player in players]
+        expected = {
+            (p0, p1): (1, 1, 5, 4), (p1, p0): (1, 1, 4, 5),
+            (p0, p2): (1, 0, 3, 0), (p2, p0): (0, 1, 0, 3),
+        }
+        self.assertEqual(HeadToHead.objects.matrix(), expected)
+
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        data = self.client.get('/head-to-head.json').json()
+        self.assertEqual([p['id'] for p in data['players']], list(Player.objects.order_by('-elo').values_list(
+            'id', flat=True)))
+        self.assertEqual({(r['player'], r['opponent']): (r['wins'], r['losses'], r['legs_won'], r['legs_lost'])
+                          for r in data['results']}, expected)
+
+        response = self.client.get('/head-to-head/')
+        order = [p.pk for p in response.context['players']]
+        self.assertEqual(order, [p['id'] for p in data['players']])
+        for player, cells in response.context['rows']:
+            self.assertEqual(cells, [expected.get((player.pk, opponent)) for opponent in order])
+
+
+class ImportTest(TestCase):
+    ROWS = [
+        {'date': '2020-01-10', 'player': 'Spieler0', 'player_score': 3, 'opponent': 'Spieler1', 'opponent_score': 1},
+        {'date': '2020-01-11T18:30:00', 'player': 'Spieler2', 'player_score': 1, 'opponent': 'Spieler0',
+         'opponent_score': 3},
+        # a tie, won by the first participation like a reported result
+        {'date': '2020-01-12', 'player': 'Spieler1', 'player_score': 2, 'opponent': 'Spieler2', 'opponent_score': 2},
+    ]
+
+    def setUp(self):
+        self.players = make_players(3)
+
+    def import_results(self, suffix, content, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as f:
+            f.write(content)
+            f.flush()
+            call_command('import_results', f.name, stdout=io.StringIO(), **options)
+
+    def get_imported(self):
+        """Everything the import writes, without the match ids"""
+        matches = [
+            (match.date, match.winner_id, match.loser_id, match.num_legs,
+             list(match.participations.order_by('id').values_list('player', 'score', 'delta')))
+            for match in Match.objects.order_by('date')
+        ]
+        return matches, dict(Player.objects.values_list('id', 'elo')), get_statistics()
+
+    def test_csv_and_jsonl(self):
+        out = io.StringIO()
+        writer = csv.DictWriter(out, ['date', 'player', 'player_score', 'opponent', 'opponent_score'])
+        writer.writeheader()
+        writer.writerows(self.ROWS)
+        self.import_results('.csv', out.getvalue())
+        imported = self.get_imported()
+
+        Match.objects.all().delete()
+        self.import_results('.jsonl', ''.join(json.dumps(row) + '\n' for row in self.ROWS))
+        self.assertEqual(self.get_imported(), imported)
+
+        matches, ratings, _ = imported
+        self.assertEqual([match[1:4] for match in matches], [
+            (self.players[0].pk, self.players[1].pk, 4),
+            (self.players[0].pk, self.players[2].pk, 4),
+            (self.players[1].pk, self.players[2].pk, 4),
+        ])
+        self.assertEqual(matches[1][0], timezone.make_aware(datetime(2020, 1, 11, 18, 30)))
+        self.assertEqual(HeadToHead.objects.get(player=self.players[1], opponent=self.players[2]).wins, 1)
+        self.assertEqual(PlayerStats.objects.get(player=self.players[0]).matches_won, 2)
+        # the ratings are replayed once after the import
+        self.assertEqual(elo.recompute()[1:3], (0, 0))
+        self.assertEqual(dict(Player.objects.values_list('id', 'elo')), ratings)
+
+    def test_unknown_player(self):
+        rows = self.ROWS[:1] + [dict(self.ROWS[1], opponent='Niemand')]
+        content = ''.join(json.dumps(row) + '\n' for row in rows)
+        with self.assertRaisesRegex(CommandError, "Invalid row 2: .*unknown player 'Niemand'"):
+            self.import_results('.jsonl', content)
+        self.assertFalse(Match.objects.exists())
+
+        self.import_results('.jsonl', content, create_players=True)
+        player = Player.objects.get(name='Niemand')
+        self.assertEqual(Match.objects.filter(participations__player=player).count(), 1)
+
+
+class LeaderboardTest(TestCase):
+    def test_tied_ranks(self):
+        cache.clear()
+        players = make_players(5)
+        for player, rating in zip(players, [1100, 1050, 1050, 1000, 1050]):
+            Player.objects.filter(pk=player.pk).update(elo=rating)
+        expected = [(players[i].pk, rank) for i, rank in [(0, 1), (1, 2), (2, 2), (4, 2), (3, 5)]]
+        self.assertEqual([(p.pk, p.rank) for p in Player.objects.ranked()], expected)
+
+        engine = engines.get_engine(engines.EloEngine.name)
+        self.assertEqual([(p.pk, p.rank) for p in leaderboard.get_leaderboard(engine)], expected)
+        self.assertEqual(leaderboard.get_rank(players[4], engine), 2)
+        self.assertEqual(leaderboard.get_rank(players[3], engine), 5)
+
+
+class SeasonTest(TestCase):
+    def setUp(self):
+        self.players = make_players(5)
+
+    def day(self, day, hour=12):
+        return datetime(2020, 1, day, hour, tzinfo=timezone.utc)
+
+    def play(self, day, a, b):
+        make_match(self.players[a], 3, self.players[b], 1, date=self.day(day))
+
+    def standings(self, players):
+        return [(p.pk, p.rank, p.rating) for p in players]
+
+    def test_as_of(self):
+        self.play(1, 0, 1)
+        self.play(2, 2, 3)
+        elo.recompute()
+        before = dict(Player.objects.values_list('id', 'elo'))
+        for day, a, b in [(3, 0, 2), (4, 1, 3), (6, 4, 0)]:
+            self.play(day, a, b)
+        elo.recompute()
+
+        # both winners and both losers of the first two matches share their rank
+        self.assertEqual(self.standings(Player.objects.as_of(self.day(2, 18))), [
+            (self.players[i].pk, rank, before[self.players[i].pk]) for i, rank in [(0, 1), (2, 1), (1, 3), (3, 3)]
+        ])
+        self.assertEqual(self.standings(Player.objects.as_of(self.day(7))),
+                         [(p.pk, p.rank, p.elo) for p in Player.objects.ranked()])
+        # player 2 did not play from day 4 on
+        self.assertEqual({p.pk for p in Player.objects.as_of(self.day(7), since=self.day(4, 0))},
+                         {self.players[i].pk for i in (0, 1, 3, 4)})
+        self.assertFalse(Player.objects.as_of(self.day(1, 0)).exists())
+
+    def test_close(self):
+        for day, a, b in [(1, 0, 1), (3, 0, 2), (4, 1, 3), (6, 4, 0)]:
+            self.play(day, a, b)
+        elo.recompute()
+        season = Season.objects.create(name='Januar', slug='januar', start=self.day(2, 0), end=self.day(5, 0))
+        computed = [(p.pk, p.rank, p.rating, p.season_matches) for p in season.get_standings()]
+        # player 4 only played after the season, player 1 twice but once before it
+        self.assertEqual({row[0]: row[3] for row in computed},
+                         {self.players[i].pk: 1 for i in range(4)})
+        self.assertEqual([row[:3] for row in computed],
+                         self.standings(Player.objects.as_of(season.end, since=season.start)))
+
+        self.assertEqual(season.close(), 4)
+        self.assertTrue(Season.objects.get(pk=season.pk).closed)
+        # a late result changes the ratings, but not the closed standings
+        self.play(4, 3, 0)
+        elo.recompute()
+        self.assertEqual([(p.pk, p.rank, p.rating, p.season_matches) for p in season.get_standings()], computed)
+        self.assertNotEqual([(p.pk, p.rank, p.rating) for p in season.compute_standings()],
+                            [row[:3] for row in computed])
+
+        # closing again freezes them anew
+        self.assertEqual(season.close(), 4)
+        self.assertEqual(SeasonStanding.objects.filter(season=season).count(), 4)
+        self.assertEqual([(p.pk, p.rank, p.rating, p.season_matches) for p in season.get_standings()],
+                         [(p.pk, p.rank, p.rating, p.season_matches) for p in season.compute_standings()])
+
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        response = self.client.get('/seasons/januar/')
+        self.assertContains(response, 'Januar')
+        self.assertContains(response, 'Spieler3')
+        self.assertNotContains(response, 'Spieler4')
+
+
+class StatisticsTest(TestCase):
+    def test_rebuild_players(self):
+        players = make_players(4)
+        now = timezone.now()
+        for i, (a, b, score_a, score_b) in enumerate([(0, 1, 3, 1), (1, 2, 2, 3), (0, 2, 3, 0), (2, 3, 1, 3),
+                                                       (0, 1, 1, 3), (3, 0, 3, 2)]):
+            make_match(players[a], score_a, players[b], score_b, date=now - timedelta(days=10 - i))
+        PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+        # move the first match from players 0 and 1 to players 0 and 3
+        match = Match.objects.order_by('date').first()
+        MatchParticipation.objects.filter(match=match, player=players[1]).update(player=players[3])
+        affected = [players[0].pk, players[1].pk, players[3].pk]
+        HeadToHead.objects.rebuild(affected)
+        PlayerStats.objects.rebuild(HeadToHead.objects.filter(player__in=affected), affected)
+
+        incremental = get_statistics()
+        PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+        self.assertEqual(incremental, get_statistics())
+
+    def test_rebuild_waits_for_recording(self):
+        players = make_players(2)
+        Match.objects.report(players[0], players[1], 3, 1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stats', stdout=io.StringIO())
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('date,player,player_score,opponent,opponent_score\n2020-01-01,Spieler0,3,Spieler1,2\n')
+            f.flush()
+            with self.assertRaises(CommandError):
+                call_command('import_results', f.name, stdout=io.StringIO())
+        self.assertEqual(Match.objects.count(), 1)
+
+        job, = Job.objects.claim(1, 60)
+        self.assertTrue(jobs.run(job))
+        recorded = get_statistics()
+        call_command('rebuild_stats', stdout=io.StringIO())
+        self.assertEqual(recorded, get_statistics())
+        self.assertEqual(PlayerStats.objects.get(player=players[0]).matches_won, 1)
+
+    def test_record(self):
+        players = make_players(3)
+        now = timezone.now()
+        # the last one is a tie, won by the first participation
+        for i, (a, b, score_a, score_b) in enumerate([(0, 1, 3, 1), (1, 2, 2, 3), (2, 0, 3, 0), (1, 0, 2, 2)]):
+            match = make_match(players[a], score_a, players[b], score_b, date=now - timedelta(days=5 - i))
+            match.update_statistics(*match.participations.order_by('id'))
+        recorded = get_statistics()
+        PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+        self.assertEqual(recorded, get_statistics())
+        self.assertEqual(HeadToHead.objects.get(player=players[1], opponent=players[0]).wins, 1)
+
+    def test_bogey_and_favorite(self):
+        players = make_players(5)
+        now = timezone.now()
+
+        def baseline(player):
+            # Player._calculate_statistics before the statistics were stored
+            player_stats = {}
+            for match in Match.objects.filter(participations__player=player):
+                pt1, pt2 = match.participations.order_by('id')
+                own, other = (pt1, pt2) if pt1.player_id == player.pk else (pt2, pt1)
+                won = own.score > other.score or (own.score == other.score and own.pk < other.pk)
+                player_stats.setdefault(other.player, [0, 0])[0 if won else 1] += 1
+            sorted_stats = sorted(player_stats.items(), key=lambda i: (i[1][1], -i[1][0], i[0].name))
+            bogey = favorite = None
+            if sorted_stats and sorted_stats[-1][1][1] > 0:
+                bogey = sorted_stats[-1][0]
+            if sorted_stats and sorted_stats[0][1][0] > 0:
+                favorite = sorted_stats[0][0]
+            return bogey, favorite
+
+        def check():
+            PlayerStats.objects.rebuild(HeadToHead.objects.rebuild())
+            for player in Player.objects.all():
+                self.assertEqual(tuple(stats and stats[0] for stats in (player.bogey, player.favorite)),
+                                 baseline(player))
+
+        # player 0 against player 1: 0 W, 1 L; against player 2: 1 W, 2 L, so there is no favorite
+        for i, (a, score_a, b, score_b) in enumerate([(1, 3, 0, 1), (0, 3, 2, 1), (2, 3, 0, 2), (2, 3, 0, 0)]):
+            make_match(players[a], score_a, players[b], score_b, date=now - timedelta(days=50 - i))
+        check()
+        self.assertIsNone(Player.objects.get(pk=players[0].pk).favorite)
+
+        for i in range(40):
+            a, b = i % 5, (i * 3 + 1) % 5
+            if a != b:
+                make_match(players[a], i % 4, players[b], (i * 7) % 4, date=now - timedelta(days=40 - i))
+        check()
+
+
+class ConditionalGetTest(TransactionTestCase):
+    def setUp(self):
+        self.players = make_players(2)
+        self.client.post('/login/', {'username': 'Spieler0', 'password': 'geheim'})
+        now = timezone.now()
+        self.older = make_match(self.players[0], 3, self.players[1], 1, date=now - timedelta(days=2))
+        make_match(self.players[1], 3, self.players[0], 2, date=now - timedelta(days=1))
+        elo.recompute()
+
+    def assertChanged(self, path, change):
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_older_match_deleted(self):
+        for path in ('/', '/matches/'):
+            self.assertChanged(path, lambda: Match.objects.filter(pk=self.older.pk).delete())
+            self.older = make_match(self.players[0], 3, self.players[1], 1, date=self.older.date)
+
+    def test_older_match_rerated(self):
+        MatchParticipation.objects.filter(match=self.older, player=self.players[1]).update(score=4)
+        for path in ('/', '/matches/'):
+            self.assertChanged(path, lambda: elo.rerate([p.pk for p in self.players], self.older.date, self.older.pk))
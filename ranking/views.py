@@ -1,24 +1,34 @@
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
-from django.views.generic import FormView, TemplateView, ListView, DetailView
+from django.views.decorators.http import condition
+from django.views.generic import FormView, TemplateView, DetailView
 
+from ranking import engines, fragments, leaderboard, live, matchmaking, metrics, routers
 from ranking.decorators import player_login_required
+from ranking.export import EXPORTS, FORMATS
 from ranking.forms import LoginForm, SignupForm, ReportResultForm
-from ranking.models import Match, Player, MatchParticipation
-from ranking.support import set_session_player, get_session_player, clear_session_player
+from ranking.history import get_rating_series
+from ranking.instrumentation import query_budget
+from ranking.models import HeadToHead, Match, Player, Season
+from ranking.pagination import paginate_matches
+from ranking.support import set_session_player, get_request_player, clear_session_player
 
 
 
 
 class AuthMixin(object):
-    player = None
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         player = self.get_player()
-        if player is not None:
+        if player:
             context['player'] = player
         return context
 
@@ -27,20 +37,55 @@ class AuthMixin(object):
         return super().dispatch(request, *args, **kwargs)
 
     def get_player(self):
-        if self.player is None:
-            self.player = get_session_player(self.request.session)
-        return self.player
+        return get_request_player(self.request)
 
 
-class HomeView(AuthMixin, TemplateView):
-    template_name = 'home.html'
+class ConditionalGetMixin(object):
+    """
+    Answers GET requests with 304 Not Modified while the page is unchanged.
 
+    get_etag() returns the ETag of the page, computed once per request before
+    any of the page's own queries run. There is no Last-Modified: the pages show
+    ratings and older matches that change after the fact (corrections, deleted
+    matches, recomputed ratings), so no date tells whether they are unchanged.
+    """
     def get(self, request, *args, **kwargs):
+        etag = self.get_etag()
+        view = condition(etag_func=lambda *args, **kwargs: etag)(super().get)
+        return view(request, *args, **kwargs)
+
+    def get_etag(self):
+        raise NotImplementedError
+
+    def make_etag(self, *parts):
+        """The page differs per logged in player and between full page and "load more" requests"""
+        player = self.get_player()
+        parts = (player.pk if player else None, self.request.is_ajax()) + parts
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class HomeView(ConditionalGetMixin, AuthMixin, TemplateView):
+    template_name = 'home.html'
+    query_budget = 6
+    read_replica = True
+
+    def get_engine(self):
+        """The rating engine picked by `?rating=`, unknown names fall back to the default one"""
+        return engines.ENGINES.get(self.request.GET.get('rating')) or engines.get_engine()
+
+    def get_etag(self):
+        return self.make_etag(Match.objects.newest(), fragments.get_matches_version(), leaderboard.get_version(),
+                              self.get_engine().name)
+
+    def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context['latest_matches'] = Match.objects.all()[:5]
-        context['ranking'] = Player.objects.order_by('-elo')
-        return self.render_to_response(context)
+        # participations are only loaded for matches whose fragment is not cached
+        context['latest_matches'] = Match.objects.prefetch_related(None)[:5]
+        context['engine'] = self.get_engine()
+        context['engines'] = engines.ENGINES.values()
+        context['ranking'] = leaderboard.get_leaderboard(context['engine'])
+        return context
 
 
 class LoginView(FormView):
@@ -52,8 +97,13 @@ class LoginView(FormView):
 
     def form_valid(self, form):
         set_session_player(self.request.session, form.player)
+        metrics.LOGINS.inc(result='success')
         return HttpResponseRedirect(self.get_success_url())
 
+    def form_invalid(self, form):
+        metrics.LOGINS.inc(result='failure')
+        return super().form_invalid(form)
+
 
 def logout(request):
     clear_session_player(request.session)
@@ -72,59 +122,289 @@ class SignupView(FormView):
         player.set_password(form.cleaned_data['password1'])
         player.save()
         set_session_player(self.request.session, player)
+        routers.pin_to_primary(self.request.session)
         return HttpResponseRedirect(self.get_success_url())
 
 
 class ReportResultView(AuthMixin, FormView):
     form_class = ReportResultForm
     template_name = 'report_result.html'
+    query_budget = 15
 
     success_url = reverse_lazy('home')
 
-    def get_form(self, form_class=None):
-        """Return an instance of the form to be used in this view."""
-        if form_class is None:
-            form_class = self.get_form_class()
-        form = form_class(**self.get_form_kwargs())
-        form.fields['opponent'].queryset = form.fields['opponent'].queryset.filter(~Q(pk = self.get_player().id))
-        return form
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['player'] = self.get_player()
+        return kwargs
 
     def form_valid(self, form):
         """If the form is valid, redirect to the supplied URL."""
-        match = Match.objects.create(
-            date=timezone.now()
-        )
-        MatchParticipation.objects.create(
-            match=match,
-            player=self.get_player(),
-            score=form.cleaned_data['player_score'],
-            delta=0
+        Match.objects.report(
+            self.get_player(),
+            form.cleaned_data['opponent'],
+            form.cleaned_data['player_score'],
+            form.cleaned_data['opponent_score'],
         )
+        metrics.MATCHES_REPORTED.inc()
+        routers.pin_to_primary(self.request.session)
+        return HttpResponseRedirect(self.get_success_url())
 
-        MatchParticipation.objects.create(
-            match=match,
-            player=form.cleaned_data['opponent'],
-            score=form.cleaned_data['opponent_score'],
-            delta=0
-        )
 
-        match.update_elos()
+class MatchPageMixin(object):
+    """Renders only the next page of matches for the "load more" requests"""
+    matches_per_page = 25
 
-        return HttpResponseRedirect(self.get_success_url())
+    def get_match_page(self, queryset):
+        # participations are only loaded for matches whose fragment is not cached
+        return paginate_matches(queryset.prefetch_related(None), self.request.GET.get('cursor'),
+                                self.matches_per_page)
+
+    def get_template_names(self):
+        if self.request.is_ajax():
+            return ['fragments/match_page.html']
+        return super().get_template_names()
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        patch_vary_headers(response, ['X-Requested-With'])
+        return response
 
 
-class MatchesView(AuthMixin, ListView):
-    model = Match
+class MatchesView(ConditionalGetMixin, AuthMixin, MatchPageMixin, TemplateView):
     template_name = 'matches.html'
-    ordering = '-date'
+    query_budget = 6
+    read_replica = True
 
+    def get_etag(self):
+        return self.make_etag(Match.objects.newest(), fragments.get_matches_version())
 
-class ProfileView(AuthMixin, DetailView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['match_page'] = self.get_match_page(Match.objects.all())
+        return context
+
+
+class ProfileView(ConditionalGetMixin, AuthMixin, MatchPageMixin, DetailView):
     model = Player
     slug_field = 'name'
     context_object_name = 'profile'
     template_name = 'profile.html'
+    matches_per_page = 10
+    # one more on the own profile for the active players of the suggestions
+    query_budget = 11
+    read_replica = True
+
+    def get_etag(self):
+        """
+        The profile changes with the player's own matches, with the leaderboard (the
+        rank) and, on the own profile, with the suggested opponents.
+        """
+        row = Player.objects.filter(**{self.slug_field: self.kwargs[self.slug_url_kwarg]}).values_list(
+            'id', 'stats__last_match').first()
+        if row is None:
+            return None
+        pk, last_match = row
+        return self.make_etag(pk, last_match, fragments.get_player_version(pk), leaderboard.get_version(),
+                              matchmaking.get_version())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the profile shows the Elo, whatever the leaderboard defaults to
+        context['rank'] = leaderboard.get_rank(self.object, engines.get_engine(engines.EloEngine.name))
+        context['stats_version'] = fragments.get_player_version(self.object.pk)
+        context['fragment_timeout'] = fragments.get_timeout()
+        context['match_page'] = self.get_match_page(Match.objects.filter(participations__player=self.object))
+        if self.object == self.get_player():
+            context['suggestions'] = [
+                (label, matchmaking.suggest(self.object, mode))
+                for mode, label in ((matchmaking.BALANCED, 'Ausgeglichen'), (matchmaking.INFORMATIVE, 'Aufschlussreich'))
+            ]
+        return context
+
+
+class HeadToHeadView(AuthMixin, TemplateView):
+    template_name = 'head_to_head.html'
+    query_budget = 5
+    read_replica = True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        players = list(Player.objects.order_by('-elo'))
+        matrix = HeadToHead.objects.matrix()
+        context['players'] = players
+        context['rows'] = [
+            (p, [matrix.get((p.pk, o.pk)) if p != o else None for o in players])
+            for p in players
+        ]
+        return context
+
+
+class StandingsView(AuthMixin, TemplateView):
+    """The leaderboard at the end of a day (`?date=`, today by default), with links to past months and seasons"""
+    template_name = 'standings.html'
+    query_budget = 4
+    read_replica = True
+    num_months = 12
+
+    def get(self, request, *args, **kwargs):
+        value = request.GET.get('date')
+        try:
+            self.day = parse_date(value) if value else timezone.localdate()
+        except ValueError:
+            self.day = None
+        if self.day is None:
+            return HttpResponseBadRequest('Invalid date')
+        return super().get(request, *args, **kwargs)
+
+    def get_months(self):
+        """The last days of the past months, newest first"""
+        months = []
+        day = timezone.localdate().replace(day=1)
+        for _ in range(self.num_months):
+            day -= timedelta(days=1)
+            months.append(day)
+            day = day.replace(day=1)
+        return months
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        end_of_day = timezone.make_aware(datetime.combine(self.day, time.max))
+        context['day'] = self.day
+        context['months'] = self.get_months()
+        context['seasons'] = Season.objects.all()
+        context['standings'] = Player.objects.as_of(end_of_day)
+        return context
+
+
+class SeasonView(AuthMixin, DetailView):
+    """Closed seasons show their frozen standings, the others are read from the rating snapshots"""
+    model = Season
+    template_name = 'standings.html'
+    context_object_name = 'season'
+    query_budget = 5
+    read_replica = True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['seasons'] = Season.objects.all()
+        context['standings'] = self.object.get_standings()
+        return context
+
+
+@routers.read_replica
+@query_budget(5)
+@player_login_required
+def head_to_head_json(request):
+    players = Player.objects.order_by('-elo').values('id', 'name', 'slug', 'elo')
+    matrix = HeadToHead.objects.matrix()
+    return JsonResponse({
+        'players': list(players),
+        'results': [
+            {'player': player, 'opponent': opponent, 'wins': wins, 'losses': losses,
+             'legs_won': legs_won, 'legs_lost': legs_lost}
+            for (player, opponent), (wins, losses, legs_won, legs_lost) in matrix.items()
+        ],
+    })
+
+
+@query_budget(2)
+@player_login_required
+def live_feed(request):
+    """Server-Sent Events with every newly reported match and every change of the leaderboard"""
+    response = StreamingHttpResponse(live.stream(request.META.get('HTTP_LAST_EVENT_ID')),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop nginx style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Most players are found after typing a few letters, so the list stays short
+PLAYER_SEARCH_LIMIT = 20
+
+
+@routers.read_replica
+@query_budget(2)
+@player_login_required
+def player_search(request):
+    """Opponents for the select2 widget of the report form, matched by name and paged by `page`"""
+    page = request.GET.get('page', '1')
+    if not page.isdigit() or int(page) < 1:
+        return HttpResponseBadRequest('Invalid page')
+    offset = (int(page) - 1) * PLAYER_SEARCH_LIMIT
+    players = Player.objects.search(request.GET.get('term', '')).exclude(
+        pk=get_request_player(request).pk).values_list('id', 'name')
+    players = list(players[offset:offset + PLAYER_SEARCH_LIMIT + 1])
+    return JsonResponse({
+        'results': [{'id': pk, 'text': name} for pk, name in players[:PLAYER_SEARCH_LIMIT]],
+        'more': len(players) > PLAYER_SEARCH_LIMIT,
+    })
+
+
+@routers.read_replica
+@query_budget(3)
+@player_login_required
+def matchmaking_json(request):
+    """Suggested opponents for the session player, `?mode=` balanced (default) or informative"""
+    try:
+        suggestions = matchmaking.suggest(get_request_player(request), request.GET.get('mode', matchmaking.BALANCED))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid mode')
+    return JsonResponse({'opponents': suggestions})
+
+
+def _parse_date_param(value):
+    if not value:
+        return None
+    date = parse_datetime(value)
+    if date is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        date = datetime.combine(day, time.min)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+@routers.read_replica
+@query_budget(5)
+@player_login_required
+def rating_history_json(request, slug):
+    profile = get_object_or_404(Player, slug=slug)
+    try:
+        start = _parse_date_param(request.GET.get('start'))
+        end = _parse_date_param(request.GET.get('end'))
+        max_points = min(int(request.GET.get('points', 200)), 1000)
+        if max_points < 2:
+            raise ValueError('points must be at least 2')
+    except ValueError:
+        return HttpResponseBadRequest('Invalid start, end or points')
+    series = get_rating_series(profile, start, end, max_points)
+    return JsonResponse({
+        'player': profile.slug,
+        'points': [[date.isoformat(), round(elo, 1)] for date, elo in series],
+    })
+
+
+@routers.read_replica
+@player_login_required
+def export(request, kind, fmt):
+    try:
+        fields, rows = EXPORTS[kind]
+        render, content_type = FORMATS[fmt]
+    except KeyError:
+        raise Http404('Unknown export')
+    try:
+        start = _parse_date_param(request.GET.get('start'))
+        end = _parse_date_param(request.GET.get('end'))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid start or end')
+    player = None
+    if request.GET.get('player'):
+        player = get_object_or_404(Player, slug=request.GET['player'])
 
-    #def get(self, *args, **kwargs):
-    #    print(self.get_object().participations.all()[0].match)
-    #    return super().get(*args, **kwargs)
\ No newline at end of file
+    response = StreamingHttpResponse(render(fields, rows(start, end, player)), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, fmt)
+    return response